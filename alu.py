@@ -1,17 +1,16 @@
-from functools import reduce
+import sys
+
+from array import array
 
 
 def _carry(b, *args):
 	m = (1 << b) - 1
-	s = reduce(lambda s, x: s + (x & m), args, 0)
-	return s > m
+	return sum([x & m for x in args]) > m
 
 
 def _borrow(n, *args):
 	m = (1 << n) - 1
-	a = args[0] & m
-	s = reduce(lambda s, x: s + (x & m), args[1:], 0)
-	return a < s
+	return (args[0] & m) < sum([x & m for x in args[1:]])
 
 
 def _add(b, p, q, c=0, hb=4, cb=8):
@@ -32,6 +31,57 @@ def _sub(b, p, q, c=0, hb=4, cb=8):
 	return (s, h, c, z)
 
 
+def _or(x, y):
+	return (int.from_bytes(x, 'little') | int.from_bytes(y, 'little')).to_bytes(
+	    len(x), 'little')
+
+
+def _table(sub):
+	# Result and z/c only depend on the full sum, h only on the low nibbles,
+	# so each (c, a) row is a slice of the former or'ed with one of the latter
+	if sub:
+		r = range(-256, 256)
+		res = bytes([s & 0xff for s in r])
+		zc = bytes([0x40 | (0x80 if s & 0xff == 0 else 0) | (0x10 if s < 0 else 0)
+		            for s in r])
+		hc = [bytes([0x20 if l < (b & 0xf) else 0 for b in range(256)])
+		      for l in range(-1, 16)]
+	else:
+		r = range(512)
+		res = bytes([s & 0xff for s in r])
+		zc = bytes([(0x80 if s & 0xff == 0 else 0) | (0x10 if s > 0xff else 0)
+		            for s in r])
+		hc = [bytes([0x20 if l + (b & 0xf) > 0xf else 0 for b in range(256)])
+		      for l in range(17)]
+
+	lo = []
+	hi = []
+	for c in (0, 1):
+		for a in range(256):
+			if sub:
+				i = a - c + 256
+				lo.append(res[i - 255:i + 1][::-1])
+				hi.append(_or(zc[i - 255:i + 1][::-1], hc[(a & 0xf) - c + 1]))
+			else:
+				i = a + c
+				lo.append(res[i:i + 256])
+				hi.append(_or(zc[i:i + 256], hc[(a & 0xf) + c]))
+
+	t = bytearray(0x40000)
+	t[0::2] = b''.join(lo)
+	t[1::2] = b''.join(hi)
+	t = array('H', t)
+	if sys.byteorder == 'big':
+		t.byteswap()
+	return t
+
+
+# 8-bit add/sub indexed by c << 16 | a << 8 | b. Each entry holds the
+# result in the low byte and the z/n/h/c bits of F in the high byte.
+add8_tbl = _table(False)
+sub8_tbl = _table(True)
+
+
 def signed(v):
 	if v & 0x80:
 		return 0xff00 | v
@@ -40,7 +90,8 @@ def signed(v):
 
 
 def add8(p, q, c=0):
-	return _add(8, p, q, c)
+	v = add8_tbl[c << 16 | p << 8 | q]
+	return (v & 0xff, bool(v & 0x2000), bool(v & 0x1000), bool(v & 0x8000))
 
 
 def add16(p, q, c=0):
@@ -48,7 +99,8 @@ def add16(p, q, c=0):
 
 
 def sub8(p, q, c=0):
-	return _sub(8, p, q, c)
+	v = sub8_tbl[c << 16 | p << 8 | q]
+	return (v & 0xff, bool(v & 0x2000), bool(v & 0x1000), bool(v & 0x8000))
 
 
 def add16e(p, q, c=0):
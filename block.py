@@ -0,0 +1,43 @@
+import inst
+
+
+class BlockCache(object):
+	def __init__(self, mc, limit=32, lazy=False, hot=16):
+		self.ram = getattr(mc, 'ram', mc)
+		self.limit = limit
+		self.lazy = lazy
+		self.blocks = {}
+		# Times each pc was interpreted; compiled once it reaches hot
+		self.hot = hot
+		self.hits = bytearray(0x10000)
+		self.ranges = {}
+		# Set when a write drops a block; a running block checks it after
+		# each store and returns to dispatch
+		self.stale = False
+		# Only MemCtrl can tell us about writes over compiled code
+		self.code = getattr(mc, 'code', None)
+		if self.code is not None:
+			mc.on_code_write = self.invalidate
+
+	def compile(self, pc):
+		fn, end = inst.block(self.ram, pc, self.limit, self.lazy)
+		self.blocks[pc] = fn
+		self.ranges[pc] = end
+		if self.code is not None:
+			self.code[pc:end] = b'\x01' * (end - pc)
+		return fn
+
+	def invalidate(self, addr):
+		self.stale = True
+		dead = [(s, e) for s, e in self.ranges.items() if s <= addr < e]
+		for s, e in dead:
+			del self.blocks[s]
+			del self.ranges[s]
+			self.code[s:e] = bytes(e - s)
+
+		# Blocks can overlap, so re-mark the ones that are still cached
+		for s, e in self.ranges.items():
+			for ds, de in dead:
+				if s < de and ds < e:
+					self.code[s:e] = b'\x01' * (e - s)
+					break
@@ -0,0 +1,145 @@
+from mmu import MemCtrl, MemFetcher, WordAccessor
+
+MAGIC = b'GBCOV1\x00\x00'
+
+
+class CoveredMemCtrl(MemCtrl):
+	def __getitem__(self, addr):
+		self.cover.r[addr] = 1
+		return MemCtrl.__getitem__(self, addr)
+
+	def __setitem__(self, addr, val):
+		self.cover.w[addr] = 1
+		MemCtrl.__setitem__(self, addr, val)
+
+	def read16(self, addr):
+		r = self.cover.r
+		r[addr] = 1
+		r[(addr + 1) & 0xffff] = 1
+		return MemCtrl.read16(self, addr)
+
+	def write16(self, addr, val):
+		w = self.cover.w
+		w[addr] = 1
+		w[(addr + 1) & 0xffff] = 1
+		MemCtrl.write16(self, addr, val)
+
+
+class CoveredFetcher(MemFetcher):
+	# Instruction bytes count as executed, not read, but still go through
+	# read hooks and watches
+	def fetch(self):
+		i = self.index
+		self.cover.x[i & 0xffff] = 1
+		mc = self.mc
+		if isinstance(mc, CoveredMemCtrl):
+			b = MemCtrl.__getitem__(mc, i)
+		else:
+			b = mc[i]
+
+		if self.dbg:
+			self.dbg.on_fetch(self, i, b)
+
+		self.index = i + 1
+		return b
+
+	def fetch16(self):
+		a = self.fetch()
+		return (self.fetch() << 8) | a
+
+
+def pack(m):
+	# One bit per address, lsb first. Each stride-8 plane of 0/1 bytes is
+	# shifted into its bit position as one big int.
+	n = len(m) // 8
+	v = 0
+	for i in range(8):
+		v |= int.from_bytes(m[i::8], 'little') << i
+	return v.to_bytes(n, 'little')
+
+
+def unpack(b):
+	n = len(b)
+	v = int.from_bytes(b, 'little')
+	ones = int.from_bytes(b'\x01' * n, 'little')
+	m = bytearray(n * 8)
+	for i in range(8):
+		m[i::8] = ((v >> i) & ones).to_bytes(n, 'little')
+	return m
+
+
+class Coverage(object):
+	# Executed, read and written addresses, one byte per address. Attaching
+	# swaps the cpu's memory objects to covered subclasses, so nothing is
+	# marked or checked while detached.
+	def __init__(self):
+		self.x = bytearray(0x10000)
+		self.r = bytearray(0x10000)
+		self.w = bytearray(0x10000)
+		self.ram = None
+
+	def mark(self, pc):
+		# Opcode bytes; operands are marked as they are fetched
+		self.x[pc] = 1
+		if self.ram[pc] == 0xcb:
+			self.x[(pc + 1) & 0xffff] = 1
+
+	def attach(self, cpu):
+		cpu.cover = self
+		cpu.mc.cover = self
+		self.ram = cpu.mc.ram
+		cpu.mc.__class__ = CoveredFetcher
+		mc = cpu.mc.mc
+		if isinstance(mc, MemCtrl):
+			mc.cover = self
+			mc.__class__ = CoveredMemCtrl
+			cpu.mc.as16 = WordAccessor(mc)
+
+	def detach(self, cpu):
+		cpu.cover = None
+		cpu.mc.__class__ = MemFetcher
+		mc = cpu.mc.mc
+		if isinstance(mc, CoveredMemCtrl):
+			mc.__class__ = MemCtrl
+			cpu.mc.as16 = WordAccessor(mc)
+
+	def save(self, path):
+		with open(path, 'wb') as f:
+			f.write(MAGIC)
+			for m in (self.x, self.r, self.w):
+				f.write(pack(m))
+
+	def load(self, path):
+		with open(path, 'rb') as f:
+			if f.read(len(MAGIC)) != MAGIC:
+				raise ValueError(f'{path}: not a coverage file')
+			for m in (self.x, self.r, self.w):
+				m[:] = unpack(f.read(0x2000))
+
+	def summary(self, syms=None, end=0x8000):
+		# (name, start, end, executed bytes) per symbol below end
+		if syms and syms.addrs:
+			starts = [a for a in syms.addrs if a < end]
+			names = [syms.names[i] for i, a in enumerate(syms.addrs) if a < end]
+		else:
+			starts, names = [], []
+		if not starts or starts[0] != 0:
+			starts.insert(0, 0)
+			names.insert(0, 'rom')
+		ends = starts[1:] + [end]
+		return [(n, s, e, self.x.count(1, s, e)) for n, s, e in zip(names, starts, ends)]
+
+	def lcov(self, path, syms=None, source='rom', end=0x8000):
+		# Addresses stand in for line numbers
+		rows = self.summary(syms, end)
+		with open(path, 'w') as f:
+			f.write(f'TN:\nSF:{source}\n')
+			for name, s, e, hit in rows:
+				f.write(f'FN:{s},{name}\n')
+			for name, s, e, hit in rows:
+				f.write(f'FNDA:{1 if hit else 0},{name}\n')
+			f.write(f'FNF:{len(rows)}\nFNH:{sum(1 for r in rows if r[3])}\n')
+			for a in range(end):
+				if self.x[a]:
+					f.write(f'DA:{a},1\n')
+			f.write(f'LF:{end}\nLH:{self.x.count(1, 0, end)}\nend_of_record\n')
@@ -1,9 +1,15 @@
+import struct
+
 import inst
 
 from mmu import MemCtrl, MemFetcher
+from sched import Scheduler
+from block import BlockCache
 
 
 class Flags(object):
+	__slots__ = ('val', )
+
 	def __init__(self, *args, **kwargs):
 		self.val = 0
 
@@ -48,10 +54,43 @@ class Flags(object):
 		                             'h' if self.h else '_', 'c' if self.c else '_')
 
 
+class LazyFlags(Flags):
+	# F may be behind the last 8-bit add/sub/inc/dec/cp: pend then holds
+	# (table, keep, take) for that op and arg its table index, and the flags
+	# are only looked up once something reads val
+	__slots__ = ('_val', 'pend', 'arg')
+
+	def __init__(self, *args, **kwargs):
+		self.pend = None
+		self.arg = 0
+		super().__init__(*args, **kwargs)
+
+	@property
+	def val(self):
+		if self.pend:
+			self.flush()
+		return self._val
+
+	@val.setter
+	def val(self, v):
+		self.pend = None
+		self._val = v
+
+	def flush(self):
+		tbl, keep, take = self.pend
+		self.pend = None
+		self._val = (self._val & keep) | (tbl[self.arg] >> 8 & take)
+
+
 class Regs(object):
-	def __init__(self):
+	__slots__ = ('a', 'f', 'b', 'c', 'd', 'e', 'h', 'l', 'sp', 'pc')
+
+	# a f b c d e h l sp pc
+	layout = struct.Struct('<8B2H')
+
+	def __init__(self, lazy=False):
 		self.a = 0
-		self.f = Flags()
+		self.f = LazyFlags() if lazy else Flags()
 		self.b = 0
 		self.c = 0
 		self.d = 0
@@ -68,7 +107,7 @@ class Regs(object):
 	@af.setter
 	def af(self, v):
 		self.a = (v >> 8) & 0xff
-		self.f.val = v & 0xff
+		self.f.val = v & 0xf0
 
 	@property
 	def bc(self):
@@ -97,6 +136,14 @@ class Regs(object):
 		self.h = (v >> 8) & 0xff
 		self.l = v & 0xff
 
+	def snapshot(self):
+		return self.layout.pack(self.a, self.f.val, self.b, self.c, self.d, self.e,
+		                        self.h, self.l, self.sp, self.pc)
+
+	def restore(self, buf):
+		(self.a, self.f.val, self.b, self.c, self.d, self.e, self.h, self.l,
+		 self.sp, self.pc) = self.layout.unpack(buf)
+
 	def __str__(self):
 		s = '''
 regs:
@@ -113,41 +160,83 @@ regs:
 
 
 class Cpu(object):
-	def __init__(self, mc, debugger=None):
-		self.regs = Regs()
+	def __init__(self, mc, debugger=None, blocks=False, lazy=False):
+		# Lazy flags trade the flag table lookup for more work per op, which
+		# does not pay off in CPython; they are kept for experiments and are
+		# slower than the eager path both interpreted and in blocks
+		self.regs = Regs(lazy)
+		self.ops = inst.lazy_ops if lazy else inst.base_ops
 		self.mc = MemFetcher(mc, debugger=debugger)
+		self.blocks = BlockCache(mc, lazy=lazy) if blocks else None
 		self.ei = False
 		self.di = False
 		self.intr = False
 		self.halt = False
 		self.stop = False
 		self.time = 0
+		self.insts = 0
+		self.limit = 0
+		self.sched = Scheduler(self)
 		self.debugger = debugger
+		# Per-instruction debugger hooks; see instrument
+		self.dbg = debugger
+		self.watched = False
+		# Coverage bitmaps while cover.Coverage is attached
+		self.cover = None
 
 	def decode(self):
+		if self.dbg:
+			self.decode_debug()
+			return
+
+		mc = self.mc
+		pc = self.regs.pc
+		if self.cover:
+			self.cover.mark(pc)
+		mc.index = pc + 1
+		self.ops[mc.ram[pc]](self)
+
+	def decode_debug(self):
 		self.mc.fetch_set(self.regs.pc)
 
 		b = self.mc.fetch()
 		if b == 0xcb:
 			b = b << 8 | self.mc.fetch()
-		inst.op(self, b, debugger=self.debugger)
+		inst.op(self, b, debugger=self.dbg)
 
 	def push(self, v):
-		self.mc[self.regs.sp - 1] = (v >> 8) & 0xff
-		self.mc[self.regs.sp - 2] = v & 0xff
 		self.regs.sp -= 2
+		self.mc.as16[self.regs.sp] = v
 
 	def pop(self):
-		v = self.mc[self.regs.sp] & 0xff
-		v |= (self.mc[self.regs.sp + 1] << 8) & 0xff00
+		v = self.mc.as16[self.regs.sp]
 		self.regs.sp += 2
 		return v
 
+	# CALL/RST and RET push and pop through these, so a profiler can follow
+	# the guest call stack by replacing them on the instance
+	call = push
+	ret = pop
+
 	def setup(self):
 		if self.debugger:
 			self.debugger.on_start_cpu(self)
 
-	def step(self):
+	def instrument(self, exec=None, mem=None):
+		# Route the instruction and memory paths through the debugger only
+		# where it has something to do; None leaves the bare path in place.
+		# run picks its loop once per batch, so a change ends the batch.
+		if exec is not self.dbg or (mem is not None) != self.watched:
+			self.limit = 0
+		self.dbg = exec
+		self.mc.dbg = exec
+		if hasattr(self.mc.mc, 'watch'):
+			self.mc.mc.watch(mem)
+		# Watches can stop the cpu halfway through a block, where the
+		# registers are not written back yet
+		self.watched = mem is not None
+
+	def check_intr(self):
 		if self.intr:
 			# TODO: interrupt
 			pass
@@ -159,14 +248,79 @@ class Cpu(object):
 			self.di = False
 			self.intr = False
 
-		if self.debugger:
-			self.debugger.before_exec()
+	def run(self, budget):
+		# Runs up to the budget or the next scheduled event. EI/DI cut the
+		# batch short by clearing the limit, so the pending flags are applied
+		# before the next instruction as in `step`
+		start = self.time
+		self.limit = min(start + budget, self.sched.next)
+
+		if self.dbg:
+			while self.time < self.limit:
+				self.step()
+			return self.time - start
+
+		self.check_intr()
+
+		regs = self.regs
+		ops = self.ops
+		mc = self.mc
+		ram = mc.ram
+		if self.blocks and not self.watched and not self.cover:
+			# Interpret a pc until it has been seen `hot` times, so code
+			# that runs once is not worth compiling
+			cache = self.blocks.blocks
+			compile = self.blocks.compile
+			hits = self.blocks.hits
+			hot = self.blocks.hot
+			while self.time < self.limit:
+				pc = regs.pc
+				fn = cache.get(pc)
+				if fn:
+					fn(self)
+				elif hits[pc] >= hot:
+					compile(pc)(self)
+				else:
+					hits[pc] += 1
+					mc.index = pc + 1
+					ops[ram[pc]](self)
+					self.insts += 1
+			return self.time - start
+
+		n = self.insts
+		if self.cover:
+			x = self.cover.x
+			while self.time < self.limit:
+				pc = regs.pc
+				x[pc] = 1
+				if ram[pc] == 0xcb:
+					x[(pc + 1) & 0xffff] = 1
+				mc.index = pc + 1
+				ops[ram[pc]](self)
+				n += 1
+			self.insts = n
+			return self.time - start
+
+		while self.time < self.limit:
+			pc = regs.pc
+			mc.index = pc + 1
+			ops[ram[pc]](self)
+			n += 1
+		self.insts = n
+		return self.time - start
+
+	def step(self):
+		self.check_intr()
+
+		if self.dbg:
+			self.dbg.before_exec()
 
 		tp1 = self.time
 		self.decode()
 		tp2 = self.time
+		self.insts += 1
 
-		if self.debugger:
-			self.debugger.after_exec()
+		if self.dbg:
+			self.dbg.after_exec()
 
 		return tp2 - tp1
@@ -4,6 +4,11 @@ import time
 import sys
 import cmd
 
+import cover
+import profiler
+import sym
+import tracer
+
 
 class Debugger(ABC):
 	@abstractmethod
@@ -45,6 +50,31 @@ class DebugConfig(object):
 		self.sound = True
 
 
+def _range(s):
+	# '0xc000' or '0xc000-0xdfff', both ends inclusive
+	lo, _, hi = s.partition('-')
+	lo = int(lo, 0)
+	hi = int(hi, 0) if hi else lo
+	if not 0 <= lo <= hi <= 0xffff:
+		raise ValueError(f'bad range: {s}')
+	return (lo, hi)
+
+
+def _fmt(r):
+	lo, hi = r
+	return f'{lo:04x}' if lo == hi else f'{lo:04x}-{hi:04x}'
+
+
+def _cond(s):
+	# 'spec if expr' -> ('spec', 'expr')
+	spec, _, cond = f' {s}'.partition(' if ')
+	return spec.strip(), cond.strip() or None
+
+
+def _fmtcond(cond):
+	return f' if {cond}' if cond else ''
+
+
 class DebugShell(cmd.Cmd, Debugger):
 	prompt = 'debug-shell$ '
 
@@ -55,10 +85,25 @@ class DebugShell(cmd.Cmd, Debugger):
 		self.last = None
 		self.iters = 0
 		self.cputrace = False
+		self.trace = None
 		self.cpuperf = False
+		self.prof = None
+		self.sampler = None
+		self.cov = None
+		self.syms = sym.Symbols()
 		self.cpu = None
-		self.breaks = set()
-		self.watches = set()
+		# Break and watch ranges with their conditions, and one byte per
+		# address for each kind of access so a hit test is a single index:
+		# 1 always stops, 2 stops if a condition over the address holds. The
+		# page maps tell MemCtrl which pages have a watch at all.
+		self.breaks = {}
+		self.watches = {}
+		self.exprs = {}
+		self.xmap = bytearray(0x10000)
+		self.rmap = bytearray(0x10000)
+		self.wmap = bytearray(0x10000)
+		self.rpages = bytearray(0x100)
+		self.wpages = bytearray(0x100)
 		self.nobreak = False
 		self.step = False
 		self.mnem = None
@@ -68,6 +113,7 @@ class DebugShell(cmd.Cmd, Debugger):
 
 	def on_start_cpu(self, cpu):
 		self.cpu = cpu
+		self.update()
 
 		if self.cpu and self.gpu and self.initprompt:
 			self.show_prompt()
@@ -80,9 +126,14 @@ class DebugShell(cmd.Cmd, Debugger):
 
 	def before_exec(self):
 		if self.cputrace:
-			print(f'{str(self.cpu.regs)}')
+			self.trace.record(self.cpu)
+		if self.prof:
+			self.prof.before(self.cpu)
 
 	def after_exec(self):
+		if self.prof:
+			self.prof.after(self.cpu)
+
 		if not self.cpuperf:
 			return
 
@@ -94,23 +145,22 @@ class DebugShell(cmd.Cmd, Debugger):
 			self.last = t
 
 	def on_fetch(self, mc, index, b):
-		if self.cputrace:
-			print('fetch {:04x} {:02x}'.format(index, b))
+		pass
 
 	def on_decode(self, op, mnem):
 		self.mnem = mnem
-		if self.cputrace:
-			print(f'{mnem}')
 		self.check_break(self.cpu.regs.pc)
 
 	def on_read(self, addr, v):
-		if not self.nobreak and addr in self.watches:
+		x = self.rmap[addr]
+		if x and not self.nobreak and (x == 1 or self.test(self.watches, addr, 'r')):
 			print(f'read at {addr:04x}: {v:02x}')
 			self.addr = addr
 			self.show_prompt()
 
 	def on_write(self, addr, v):
-		if not self.nobreak and addr in self.watches:
+		x = self.wmap[addr]
+		if x and not self.nobreak and (x == 1 or self.test(self.watches, addr, 'w')):
 			print(f'write at {addr:04x}: {v:02x}')
 			self.addr = addr
 			self.show_prompt()
@@ -118,20 +168,87 @@ class DebugShell(cmd.Cmd, Debugger):
 	def dump(self):
 		print(f'{str(self.cpu.regs)}')
 
-	def add_break(self, addr):
-		self.breaks.add(addr)
+	def update(self):
+		# Only hook the cpu and memory paths the enabled features need, so an
+		# idle shell runs as fast as no debugger at all
+		if not self.cpu:
+			return
+
+		exec = self.breaks or self.step or self.cputrace or self.cpuperf or self.prof
+		self.cpu.instrument(self if exec else None, self if self.watches else None)
+
+	def remap(self):
+		for m in (self.xmap, self.rmap, self.wmap):
+			m[:] = bytes(0x10000)
+
+		# Conditional ranges first so unconditional ones win where they overlap
+		marks = [(r, self.xmap, cond) for r, cond in self.breaks.items()]
+		for r, (mode, cond) in self.watches.items():
+			if 'r' in mode:
+				marks.append((r, self.rmap, cond))
+			if 'w' in mode:
+				marks.append((r, self.wmap, cond))
+		marks.sort(key=lambda m: m[2] is None)
+		for (lo, hi), m, cond in marks:
+			m[lo:hi + 1] = (b'\x02' if cond else b'\x01') * (hi + 1 - lo)
+
+		zero = bytes(0x100)
+		for m, pages in ((self.rmap, self.rpages), (self.wmap, self.wpages)):
+			for p in range(0x100):
+				pages[p] = m[p << 8:(p + 1) << 8] != zero
+		self.update()
+
+	def test(self, ranges, addr, mode=None):
+		# Check the conditions of the ranges over addr, with the address bound
+		# to `a` and breaks suppressed while they run
+		self.nobreak = True
+		try:
+			for (lo, hi), cond in ranges.items():
+				if mode:
+					m, cond = cond
+					if mode not in m:
+						continue
+				if lo <= addr <= hi and cond and self.eval(cond, addr):
+					return True
+		except Exception as e:
+			print(f'condition: {e}')
+			return True
+		finally:
+			self.nobreak = False
+		return False
+
+	def add_break(self, addr, cond=None):
+		if isinstance(addr, int):
+			addr = (addr, addr)
+		if cond:
+			self.compile(cond)
+		self.breaks[addr] = cond
+		self.remap()
 
 	def remove_break(self, addr):
-		self.breaks.remove(addr)
-
-	def add_watch(self, addr):
-		self.watches.add(addr)
+		if isinstance(addr, int):
+			addr = (addr, addr)
+		del self.breaks[addr]
+		self.remap()
+
+	def add_watch(self, addr, mode='rw', cond=None):
+		if isinstance(addr, int):
+			addr = (addr, addr)
+		if cond:
+			self.compile(cond)
+		self.watches[addr] = (mode, cond)
+		self.remap()
 
 	def remove_watch(self, addr):
-		self.watches.remove(addr)
+		if isinstance(addr, int):
+			addr = (addr, addr)
+		del self.watches[addr]
+		self.remap()
 
 	def check_break(self, addr):
-		if (not self.nobreak and addr in self.breaks) or self.step:
+		x = self.xmap[addr]
+		if (x and not self.nobreak and
+		    (x == 1 or self.test(self.breaks, addr))) or self.step:
 			self.step = False
 			self.addr = addr
 
@@ -142,6 +259,7 @@ class DebugShell(cmd.Cmd, Debugger):
 		self.nobreak = True
 		self.cmdloop()
 		self.nobreak = False
+		self.update()
 
 	def do_c(self, args):
 		'Continue execution'
@@ -174,85 +292,208 @@ class DebugShell(cmd.Cmd, Debugger):
 			print(f'{e}')
 
 	def do_b(self, args):
-		'Set break point'
+		'Set break point: b [addr|lo-hi] [if expr]'
 		try:
+			args, cond = _cond(args)
 			if args:
-				bp = int(args, 0)
+				bp = _range(args)
 			else:
-				bp = self.cpu.regs.pc
-			self.add_break(bp)
-			print(f'set break {bp:04x}')
+				bp = (self.cpu.regs.pc, self.cpu.regs.pc)
+			self.add_break(bp, cond)
+			print(f'set break {_fmt(bp)}{_fmtcond(cond)}')
 		except Exception as e:
 			print(f'{e}')
 
 	def do_rb(self, args):
-		'Remove break point'
+		'Remove break point: rb [addr|lo-hi]'
 		try:
 			if args:
-				bp = int(args, 0)
+				bp = _range(args)
 			else:
-				bp = self.cpu.regs.pc
+				bp = (self.cpu.regs.pc, self.cpu.regs.pc)
 			self.remove_break(bp)
-			print(f'remove break {bp:04x}')
+			print(f'remove break {_fmt(bp)}')
 		except Exception as e:
 			print(f'{e}')
 
 	def do_lb(self, args):
 		'List break points'
 		print('breaks:')
-		for b in self.breaks:
-			print(f'* {b:04x}')
+		for b, cond in sorted(self.breaks.items()):
+			print(f'* {_fmt(b)}{_fmtcond(cond)}')
 
 	def do_w(self, args):
-		'Add memory watch'
+		'Add memory watch: w [addr|lo-hi] [r|w|rw] [if expr]'
 		try:
+			args, cond = _cond(args)
+			args = args.split()
 			if args:
-				wp = int(args, 0)
+				wp = _range(args[0])
 			elif self.addr:
-				wp = self.addr
-			self.add_watch(wp)
-			print(f'watch {wp:04x}')
+				wp = (self.addr, self.addr)
+			mode = args[1] if len(args) > 1 else 'rw'
+			if not mode or set(mode) - set('rw'):
+				raise ValueError(f'bad mode: {mode}')
+			self.add_watch(wp, mode, cond)
+			print(f'watch {_fmt(wp)} {mode}{_fmtcond(cond)}')
 		except Exception as e:
 			print(f'{e}')
 
 	def do_rw(self, args):
-		'Remove memory watch'
+		'Remove memory watch: rw [addr|lo-hi]'
 		try:
 			if args:
-				wp = int(args, 0)
+				wp = _range(args)
 			elif self.addr:
-				wp = self.addr
+				wp = (self.addr, self.addr)
 			self.remove_watch(wp)
-			print(f'remove watch {wp:04x}')
+			print(f'remove watch {_fmt(wp)}')
 		except Exception as e:
 			print(f'{e}')
 
 	def do_lw(self, args):
 		'List memory watches'
 		print('watches:')
-		for w in self.watches:
-			print(f'* {w:04x}')
+		for w, (mode, cond) in sorted(self.watches.items()):
+			print(f'* {_fmt(w)} {mode}{_fmtcond(cond)}')
 
 	def do_ect(self, args):
-		'Enable cpu tracing'
-		self.cputrace = True
-		print('Enabled cpu trace')
+		'Enable cpu tracing: ect [file to stream records to]'
+		try:
+			if self.trace:
+				self.trace.close()
+			self.trace = tracer.TraceBuffer(path=args or None)
+			self.cputrace = True
+			self.update()
+			print('Enabled cpu trace')
+		except Exception as e:
+			print(f'{e}')
 
 	def do_dct(self, args):
 		'Disable cpu tracing'
 		self.cputrace = False
+		if self.trace:
+			self.trace.close()
+		self.update()
 		print('Disable cpu trace')
 
+	def do_tr(self, args):
+		'Show the last n cpu trace entries: tr [n]'
+		try:
+			n = int(args, 0) if args else 20
+			if self.trace:
+				for rec in self.trace.last(n):
+					print(tracer.fmt(rec))
+		except Exception as e:
+			print(f'{e}')
+
 	def do_ecp(self, args):
 		'Enable cpu perf'
 		self.cpuperf = True
+		self.update()
 		print('Enabled cpu perf')
 
 	def do_dcp(self, args):
 		'Disable cpu perf'
 		self.cpuperf = False
+		self.update()
 		print('Disabled cpu perf')
 
+	def do_eop(self, args):
+		'Enable the opcode profiler, starting from zero'
+		self.prof = profiler.OpProfile()
+		self.update()
+		print('Enabled opcode profile')
+
+	def do_dop(self, args):
+		'Disable the opcode profiler'
+		self.prof = None
+		self.update()
+		print('Disabled opcode profile')
+
+	def do_top(self, args):
+		'Show the hottest opcodes and pcs: top [n]'
+		try:
+			if self.prof:
+				print(self.prof.report(int(args, 0) if args else 20))
+		except Exception as e:
+			print(f'{e}')
+
+	def do_xop(self, args):
+		'Export the opcode profile as csv or json: xop <file>'
+		try:
+			self.prof.export(args)
+			print(f'Wrote {args}')
+		except Exception as e:
+			print(f'{e}')
+
+	def do_sym(self, args):
+		'Load an RGBDS symbol file: sym <file>'
+		try:
+			self.syms.load(args)
+			print(f'{len(self.syms.addrs)} symbols')
+		except Exception as e:
+			print(f'{e}')
+
+	def do_esp(self, args):
+		'Start sampling the guest pc and call stack: esp [every n cycles]'
+		try:
+			if self.sampler:
+				self.sampler.stop()
+			every = int(args, 0) if args else 1000
+			self.sampler = profiler.StackSampler(self.cpu, every, self.syms)
+			self.sampler.start()
+			print(f'Sampling every {every} cycles')
+		except Exception as e:
+			print(f'{e}')
+
+	def do_dsp(self, args):
+		'Stop sampling and print or write collapsed stacks: dsp [file]'
+		try:
+			if self.sampler:
+				self.sampler.stop()
+				if args:
+					self.sampler.write(args)
+					print(f'Wrote {args}')
+				else:
+					for l in self.sampler.collapsed():
+						print(l)
+			self.sampler = None
+		except Exception as e:
+			print(f'{e}')
+
+	def do_ecov(self, args):
+		'Start recording executed/read/written addresses'
+		if not self.cov:
+			self.cov = cover.Coverage()
+		if self.cpu.cover is None:
+			self.cov.attach(self.cpu)
+		print('Enabled coverage')
+
+	def do_dcov(self, args):
+		'Stop recording coverage, keeping what was recorded'
+		if self.cov:
+			self.cov.detach(self.cpu)
+		print('Disabled coverage')
+
+	def do_xcov(self, args):
+		'Save the coverage bitmaps: xcov <file>'
+		try:
+			self.cov.save(args)
+			print(f'Wrote {args}')
+		except Exception as e:
+			print(f'{e}')
+
+	def do_lcov(self, args):
+		'Write per-symbol rom coverage in lcov format: lcov <file>'
+		try:
+			self.cov.lcov(args, self.syms)
+			for name, s, e, hit in self.cov.summary(self.syms):
+				print(f'{s:04x}-{e - 1:04x} {100 * hit / (e - s):5.1f}% {name}')
+			print(f'Wrote {args}')
+		except Exception as e:
+			print(f'{e}')
+
 	def do_u(self, args):
 		'Update debug config'
 		args = args.split()
@@ -279,11 +520,19 @@ class DebugShell(cmd.Cmd, Debugger):
 		for k, v in self.cfg.__dict__.items():
 			print(f'* {k}: {v}')
 
-	def eval(self, s):
-		r = self.cpu.regs
-		f = self.cpu.regs.f
-		m = self.cpu.mc
-		d = self
-		a = self.addr
-		g = self.gpu
-		return eval(s)
+	def compile(self, s):
+		code = self.exprs.get(s)
+		if code is None:
+			code = self.exprs[s] = compile(s, '<debug>', 'eval')
+		return code
+
+	def eval(self, s, a=None):
+		ns = {
+		    'r': self.cpu.regs,
+		    'f': self.cpu.regs.f,
+		    'm': self.cpu.mc,
+		    'd': self,
+		    'a': self.addr if a is None else a,
+		    'g': self.gpu,
+		}
+		return eval(self.compile(s), ns)
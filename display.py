@@ -0,0 +1,53 @@
+# Grey level of each of the four DMG shades, lightest first
+SHADES = (0.9, 0.7, 0.5, 0.3)
+
+# RGBA bytes of each shade
+RGBA = ((0xe6, 0xe6, 0xe6, 0xff), (0xb3, 0xb3, 0xb3, 0xff),
+        (0x80, 0x80, 0x80, 0xff), (0x4d, 0x4d, 0x4d, 0xff))
+
+
+class Display(object):
+	# What Gpu draws into: a contiguous framebuffer of width * height 2-bit
+	# color indices, row major, and vblank() once per frame. The
+	# palette register maps indices to shades when the frame is presented, via
+	# lut for grey levels or rgba() for pixels. on_frame, if set, is called
+	# with the display after each frame.
+	width = 166
+	height = 140
+
+	def __init__(self, on_frame=None):
+		self.vram = bytearray(b'\x03') * (self.width * self.height)
+		self.on_frame = on_frame
+		self.frames = 0
+		self.set_palette(0xe4)
+
+	def set_palette(self, bgp):
+		self.bgp = bgp
+		self.shades = [(bgp >> (2 * i)) & 3 for i in range(4)]
+		self.lut = [SHADES[s] for s in self.shades]
+		self.tables = None
+
+	def rgba(self):
+		# One translate per channel through tables cached per palette
+		if self.tables is None:
+			self.tables = [
+			    bytes(RGBA[self.shades[i & 3]][c] for i in range(256)) for c in range(4)
+			]
+		vram = self.vram
+		buf = bytearray(len(vram) * 4)
+		for c, t in enumerate(self.tables):
+			buf[c::4] = vram.translate(t)
+		return buf
+
+	def vblank(self):
+		self.frames += 1
+		if self.on_frame:
+			self.on_frame(self)
+
+	def show(self):
+		pass
+
+
+class Headless(Display):
+	# No window; frames are only handed to on_frame
+	pass
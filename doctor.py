@@ -0,0 +1,103 @@
+import argparse
+import collections
+import sys
+
+from cpu import Cpu
+from mmu import MemCtrl, load
+
+FIELDS = ('A', 'F', 'B', 'C', 'D', 'E', 'H', 'L', 'SP', 'PC', 'PCMEM')
+
+
+def state(cpu):
+	# One line of Gameboy Doctor log for the instruction about to run
+	r = cpu.regs
+	ram = cpu.mc.ram
+	pc = r.pc
+	mem = ','.join(f'{ram[(pc + i) & 0xffff]:02X}' for i in range(4))
+	return (f'A:{r.a:02X} F:{r.f.val:02X} B:{r.b:02X} C:{r.c:02X} '
+	        f'D:{r.d:02X} E:{r.e:02X} H:{r.h:02X} L:{r.l:02X} '
+	        f'SP:{r.sp:04X} PC:{pc:04X} PCMEM:{mem}')
+
+
+def diff(expect, got):
+	e = dict(f.split(':', 1) for f in expect.split())
+	g = dict(f.split(':', 1) for f in got.split())
+	return [f for f in FIELDS if e.get(f) != g.get(f)]
+
+
+def compare(cpu, lines, keep=10):
+	# Step cpu along lines of a reference log. Returns None if every line
+	# matches, or (index, expected, got, last matching lines), where got is
+	# the exception if the instruction at that line raised.
+	hist = collections.deque(maxlen=keep)
+	for n, expect in enumerate(lines):
+		expect = expect.strip()
+		if not expect:
+			continue
+		got = state(cpu)
+		if got != expect:
+			return n, expect, got, list(hist)
+		try:
+			cpu.step()
+		except Exception as e:
+			return n, expect, e, list(hist)
+		hist.append(got)
+	return None
+
+
+def setup(rom, boot=False, lazy=False):
+	# Cartridge without a mapper and LY pinned to 0x90, as the logs expect.
+	# Always without blocks: the log is checked after every instruction, and
+	# a block runs many at once.
+	mc = MemCtrl()
+	mc.add_rdhook(0xff44, lambda addr: 0x90)
+	cpu = Cpu(mc, lazy=lazy)
+	if rom:
+		if boot:
+			mc.ram[0x0100:0x8000] = rom[0x0100:0x8000].ljust(0x7f00, b'\x00')
+		else:
+			mc.ram[0x0000:0x8000] = rom[:0x8000].ljust(0x8000, b'\x00')
+	if not boot:
+		cpu.regs.af = 0x01b0
+		cpu.regs.bc = 0x0013
+		cpu.regs.de = 0x00d8
+		cpu.regs.hl = 0x014d
+		cpu.regs.sp = 0xfffe
+		cpu.regs.pc = 0x0100
+	return cpu
+
+
+def main():
+	p = argparse.ArgumentParser(description='Compare against a Gameboy Doctor log')
+	p.add_argument('rom')
+	p.add_argument('log')
+	p.add_argument('-n', '--keep', type=int, default=10,
+	               help='matching lines to show before a divergence')
+	p.add_argument('--boot', action='store_true',
+	               help='run the boot rom instead of starting at 0100')
+	p.add_argument('--lazy', action='store_true', help='use lazy flags')
+	args = p.parse_args()
+
+	cpu = setup(load(args.rom), args.boot, args.lazy)
+	with open(args.log, 'r') as f:
+		res = compare(cpu, f, args.keep)
+
+	if res is None:
+		print('log matches')
+		return 0
+
+	n, expect, got, hist = res
+	for l in hist:
+		print(f'  {l}')
+	if isinstance(got, Exception):
+		got = f'{type(got).__name__}: {got}'
+		print(f'diverged at line {n + 1}: raised')
+	else:
+		print(f'diverged at line {n + 1}: {",".join(diff(expect, got))}')
+	print(f'- {expect}')
+	print(f'+ {got}')
+	return 1
+
+
+if __name__ == '__main__':
+	sys.exit(main())
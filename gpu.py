@@ -1,48 +1,21 @@
-import ui
-from scene import *
+from display import Headless
 
+try:
+	import numpy as np
+except ImportError:
+	np = None
 
-class Lcd(Scene):
-	def __init__(self):
-		super().__init__()
-		self.width = 166
-		self.height = 140
-		self.vram = [0.3] * self.width * self.height
-
-	def setup(self):
-		self.background_color = 'white'
-
-	def draw(self):
-		#return
-		sw, sh = self.size
-		s = 2
-		xoff = (sw - self.width * s) // 2
-		yoff = 30  # sh - self.height * s - 30
-
-		#image(self.imgid, xoff, yoff, self.width * s, self.height * s)
-		#return
-
-		w = self.width
-		h = self.height
-		vram = self.vram
-
-		for x in range(w):
-			for y in range(h):
-				i = x + y * w
-				px = x * s + xoff
-				py = sh - y * s - yoff
-
-				fill(vram[i])
-				rect(px, py, s, s)
-
-	def show(self):
-		run(self, orientation=PORTRAIT, frame_interval=3)
+# Byte b with bit 7-i moved to the low bit of byte i, so a tile row's two
+# bitplanes decode to eight 2-bit indices with one shift and or
+_spread = [
+    sum(((b >> (7 - i)) & 1) << (8 * (7 - i)) for i in range(8)) for b in range(256)
+]
 
 
 class Gpu:
-	def __init__(self, mc, debugger=None, show=True):
+	def __init__(self, mc, sched, debugger=None, display=None, vectorize=False):
 		super().__init__()
-		self.lcd = Lcd()
+		self.lcd = display or Headless()
 		self.enable = False
 		self.winbase = 0x9800
 		self.winenable = False
@@ -52,26 +25,53 @@ class Gpu:
 		self.spenable = False
 		self.bgenable = False
 		self.mc = mc
-		self.palette = [0.9, 0.7, 0.5, 0.3]
-		self.buf = [0.3] * 256 * 256
-		self.show = show
+		self.ram = getattr(mc, 'ram', mc)
+		# 384 tiles of 8 rows of 8 color indices, kept in step with VRAM
+		self.tiles = bytearray(384 * 64)
+		for addr in range(0x8000, 0x9800, 2):
+			self.decode(addr, self.ram[addr], self.ram[addr + 1])
+		self.sched = sched
+		self.event = None
+		# BG and window maps of color indices; BGP is applied by the display.
+		# Map entries marked dirty, directly or through a stale tile, are
+		# redrawn at the next scanline.
+		self.buf = bytearray(b'\x03') * (256 * 256)
+		self.win = bytearray(b'\x03') * (256 * 256)
+		self.bgdirty = bytearray(b'\x01') * 0x400
+		self.windirty = bytearray(b'\x01') * 0x400
+		self.stale = bytearray(384)
+		self.pending = True
+		self.bgp = 0xe4
+		self.obp0 = 0xff
+		self.obp1 = 0xff
 		self.mode = 2
+		self.timing = {2: 80, 3: 172, 0: 204, 1: 456}
 		self.ly = 0
-		self.clks = 0
 		self.scx = 0
 		self.scy = 0
 		self.lyc = 0
+		self.wy = 0
+		self.wx = 0
+		# Window row for the next line that shows the window
+		self.winline = 0
 		self.debugger = debugger
 
+		# NumPy redraws all dirty cells of a map in one indexed assignment
+		# from views on the tile cache and ram
+		self.vectorize = vectorize and np is not None
+		if self.vectorize:
+			self.tiles_np = np.frombuffer(self.tiles, np.uint8).reshape(384, 8, 8)
+			self.ram_np = np.frombuffer(self.ram, np.uint8)
+			self.raster = self.raster_np
+
 		mc.add_rdhook((0xff40, 0xff4f), self.on_read)
 		mc.add_wrhook((0xff40, 0xff4f), self.on_write)
-		mc.add_wrhook((0x8000, 0x9fff), self.on_oam_update)
+		mc.add_wrhook((0x8000, 0xa000), self.on_oam_update)
 
-	def setup(self, show=True):
+	def setup(self):
 		if self.debugger:
 			self.debugger.on_start_gpu(self)
-		if self.show:
-			self.lcd.show()
+		self.lcd.show()
 
 	def on_read(self, addr):
 		#print(f'gpu read: {addr:04x}')
@@ -94,15 +94,59 @@ class Gpu:
 			self.ly = 0
 		elif addr == 0xff45:
 			self.lyc = val
+		elif addr == 0xff47:
+			self.bgp = val
+			self.lcd.set_palette(val)
+		elif addr == 0xff48:
+			self.obp0 = val
+		elif addr == 0xff49:
+			self.obp1 = val
+		elif addr == 0xff4a:
+			self.wy = val
+		elif addr == 0xff4b:
+			self.wx = val
 		else:
 			print(f'gpu write: {addr:04x}, {val:04x}')
 		pass
 
 	def on_oam_update(self, addr, val):
-		pass
+		# Runs before the write lands in ram
+		if self.ram[addr] == val:
+			return
+		self.pending = True
+		if addr < 0x9800:
+			self.stale[(addr - 0x8000) >> 4] = 1
+			if addr & 1:
+				self.decode(addr - 1, self.ram[addr - 1], val)
+			else:
+				self.decode(addr, val, self.ram[addr + 1])
+		else:
+			if addr & 0xfc00 == self.bgbase:
+				self.bgdirty[addr & 0x3ff] = 1
+			if addr & 0xfc00 == self.winbase:
+				self.windirty[addr & 0x3ff] = 1
+
+	def decode(self, addr, l, h):
+		i = (addr - 0x8000) * 4
+		self.tiles[i:i + 8] = (_spread[l] | _spread[h] << 1).to_bytes(8, 'big')
+
+	def tile(self, i):
+		# Tile number of map entry i under the current LCDC addressing mode
+		if self.bgwinbase == 0x8000:
+			return i
+		return 0x100 + (i ^ 0x80) - 0x80
+
+	def entry(self, t):
+		# Map entry value for tile t, or None if the mode cannot address it
+		if self.bgwinbase == 0x8000:
+			return t if t < 0x100 else None
+		if t < 0x80:
+			return None
+		return t & 0xff
 
 	def write_ctrl(self, v):
 		old_enable = self.enable
+		old = (self.bgwinbase, self.bgbase, self.winbase, self.winenable)
 
 		self.enable = v & 0x80
 		if v & 0x40:
@@ -125,6 +169,16 @@ class Gpu:
 		self.spenable = v & 0x02
 		self.bgenable = v & 0x01
 
+		if self.bgwinbase != old[0] or self.bgbase != old[1]:
+			self.bgdirty[:] = b'\x01' * 0x400
+			self.pending = True
+		if self.bgwinbase != old[0] or self.winbase != old[2]:
+			self.windirty[:] = b'\x01' * 0x400
+			self.pending = True
+		# The window map is only drawn while enabled
+		if self.winenable and not old[3]:
+			self.pending = True
+
 		print(f'ctrl: {v:04x}')
 		print(f'winbase: {self.winbase:04x}')
 		print(f'bgbase: {self.bgbase:04x}')
@@ -133,77 +187,106 @@ class Gpu:
 		if not old_enable and self.enable:
 			print(f'LCD enabled')
 			self.ly = 0
-			self.clks = 0
 			self.mode = 2
+			self.event = self.sched.after(self.timing[2], self.tick)
 		elif old_enable and not self.enable:
 			print(f'LCD disable')
+			self.sched.cancel(self.event)
+			self.event = None
 
-	def step(self, t):
-		if not self.enable:
-			return
-
-		self.clks += t
-
+	def tick(self, time):
 		if self.mode == 2:
-			if self.clks >= 80:
-				self.clks = 0
-				self.mode = 3
+			self.mode = 3
 		elif self.mode == 3:
-			if self.clks >= 172:
-				self.clks = 0
-				self.mode = 0
-				self.scanline()
+			self.mode = 0
+			self.scanline()
 		elif self.mode == 0:
-			if self.clks >= 204:
-				self.clks = 0
-				self.ly += 1
-				if self.ly == 143:
-					self.mode = 1
-				else:
-					self.mode = 2
+			self.ly += 1
+			if self.ly == 143:
+				self.mode = 1
+				self.lcd.vblank()
+			else:
+				self.mode = 2
 		elif self.mode == 1:
-			if self.clks >= 456:
-				self.clks = 0
-				self.ly += 1
-				if self.ly > 153:
-					self.mode = 2
-					self.ly = 0
+			self.ly += 1
+			if self.ly > 153:
+				self.mode = 2
+				self.ly = 0
+
+		self.event = self.sched.at(time + self.timing[self.mode], self.tick)
 
 	def scanline(self):
 		if self.ly >= self.lcd.height:
 			return
 
-		self.fetchline()
+		if self.pending:
+			self.flush()
 
+		# Copy the line out of the map, wrapping at the right edge
 		vram = self.lcd.vram
-		y = self.ly
-		yy = (y + self.scy) % 256
-		for x in range(0, self.lcd.width):
-			xx = (x + self.scx) % 256
-			i = x + y * self.lcd.width
-			j = xx + yy * 256
-			vram[i] = self.buf[j]
-
-	def fetchline(self):
-		m = self.mc
-		tmap = self.bgbase
-		tset = self.bgwinbase
-		y = (self.ly + self.scy) % 256
-
-		ty = y // 8
-		j = y % 8
-
-		for tx in range(32):
-			i = tx + ty * 32
-			tile = tset + m[tmap + i] * 16
-
-			l = m[tile + j * 2]
-			h = m[tile + j * 2 + 1]
-
-			for x in range(8):
-				col = (l >> (7 - x)) & 1
-				col |= ((h >> (7 - x)) & 1) << 1
-				col = self.palette[col]
-				xx = (i % 32) * 8 + x
-				yy = (i // 32) * 8 + j
-				self.buf[xx + yy * 256] = col
+		buf = self.buf
+		w = self.lcd.width
+		i = self.ly * w
+		row = ((self.ly + self.scy) % 256) * 256
+		x = self.scx
+		n = min(w, 256 - x)
+		vram[i:i + n] = buf[row + x:row + x + n]
+		if n < w:
+			vram[i + n:i + w] = buf[row:row + w - n]
+
+		# The window covers the line from WX - 7, taking the next row of its
+		# own map; WX below 7 clips its left edge
+		if self.ly == 0:
+			self.winline = 0
+		if self.winenable and self.ly >= self.wy and self.wx < w + 7:
+			x = max(self.wx - 7, 0)
+			row = self.winline * 256 + x - (self.wx - 7)
+			vram[i + x:i + w] = self.win[row:row + w - x]
+			self.winline += 1
+
+	def flush(self):
+		# Mark the map entries using stale tiles, then redraw dirty cells
+		stale = self.stale
+		ram = self.ram
+		maps = ((self.bgbase, self.bgdirty), (self.winbase, self.windirty))
+		t = stale.find(1)
+		while t >= 0:
+			b = self.entry(t)
+			if b is not None:
+				for base, dirty in maps:
+					e = ram.find(b, base, base + 0x400)
+					while e >= 0:
+						dirty[e - base] = 1
+						e = ram.find(b, e + 1, base + 0x400)
+			t = stale.find(1, t + 1)
+		stale[:] = bytes(384)
+
+		self.raster(self.buf, self.bgbase, self.bgdirty)
+		# The window is left dirty until it is enabled
+		if self.winenable:
+			self.raster(self.win, self.winbase, self.windirty)
+		self.pending = False
+
+	def raster(self, buf, base, dirty):
+		ram = self.ram
+		tiles = self.tiles
+		e = dirty.find(1)
+		while e >= 0:
+			t = self.tile(ram[base + e]) * 64
+			x = (e >> 5) * 2048 + (e & 31) * 8
+			for j in range(8):
+				buf[x:x + 8] = tiles[t:t + 8]
+				x += 256
+				t += 8
+			e = dirty.find(1, e + 1)
+		dirty[:] = bytes(0x400)
+
+	def raster_np(self, buf, base, dirty):
+		e = np.flatnonzero(np.frombuffer(dirty, np.uint8))
+		if len(e):
+			ids = self.ram_np[base + e]
+			if self.bgwinbase != 0x8000:
+				ids = ids.view(np.int8).astype(np.intp) + 0x100
+			cells = np.frombuffer(buf, np.uint8).reshape(32, 8, 32, 8)
+			cells[e >> 5, :, e & 31, :] = self.tiles_np[ids]
+		dirty[:] = bytes(0x400)
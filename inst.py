@@ -1,15 +1,11 @@
-import yaml
+import hashlib
+import marshal
 import os
 import re
+import sys
 import alu
 
 
-def z(v):
-	if v == 0:
-		return 1
-	return 0
-
-
 def _rl(n, b):
 	r = n & (1 << (b - 1))
 	n <<= 1
@@ -29,7 +25,7 @@ def _rr(n, b):
 
 
 base_tmpl = '''
-def op_{0:02x}(cpu, size={1}, time={2}):
+def {5}op_{0:02x}(cpu, size={1}, time={2}):
 	regs = cpu.regs
 	{3}
 	{4}
@@ -54,20 +50,16 @@ dec16_tmpl = '''
 
 # INC8
 inc8_tmpl = '''
-	s, h, _, z = alu.add8({0}, 1)
-	{0} = s
-	flgs.h = h
-	flgs.n = 0
-	flgs.z = z
+	v = alu.add8_tbl[({0}) << 8 | 1]
+	{0} = v & 0xff
+	flg(v >> 8)
 '''
 
 # DEC8
 dec8_tmpl = '''
-	s, h, _, z = alu.sub8({0}, 1)
-	{0} = s
-	flgs.h = h
-	flgs.n = 1
-	flgs.z = z
+	v = alu.sub8_tbl[({0}) << 8 | 1]
+	{0} = v & 0xff
+	flg(v >> 8)
 '''
 
 # LD t,f
@@ -89,107 +81,143 @@ ldi_tmpl = '''
 
 # LGHL
 ldhl_tmpl = '''
-	s, h, c, z = alu.add16e({0}, {1})
+	s, h, c, zf = alu.add16e({0}, {1})
 	regs.hl = s
-	flgs.h = h
-	flgs.c = c
-	flgs.z = 0
-	flgs.n = 0
+	flg(0, 0, h, c)
 '''
 
 # ADD16
 add16_tmpl = '''
-	s, h, c, z = alu.add16({0}, {1})
+	s, h, c, zf = alu.add16({0}, {1})
 	{0} = s
-	flgs.h = h
-	flgs.c = c
-	flgs.n = 0
+	flg(zf, 0, h, c)
 '''
 
 # ADD8
 add8_tmpl = '''
-	s, h, c, z = alu.add8({0}, {1})
-	{0} = s
-	flgs.h = h
-	flgs.c = c
-	flgs.n = 0
-	flgs.z = z
+	v = alu.add8_tbl[({0}) << 8 | ({1})]
+	{0} = v & 0xff
+	flg(v >> 8)
 '''
 
 # ADD SP,n
 addsp_tmpl = '''
-	s, h, c, z = alu.add16e({0}, {1})
+	s, h, c, zf = alu.add16e({0}, {1})
 	{0} = s
-	flgs.h = h
-	flgs.c = c
-	flgs.z = 0
-	flgs.n = 0
+	flg(0, 0, h, c)
 '''
 
 # ADC8
 adc_tmpl = '''
-	s, h, c, z = alu.add8({0}, {1}, flgs.c)
-	{0} = s
-	flgs.h = h
-	flgs.c = c
-	flgs.n = 0
-	flgs.z = z
+	v = alu.add8_tbl[(flgs.val & 0x10) << 12 | ({0}) << 8 | ({1})]
+	{0} = v & 0xff
+	flg(v >> 8)
 '''
 
 # SUB
 sub_tmpl = '''
-	s, h, c, z = alu.sub8(regs.a, {0})
-	regs.a = s
-	flgs.h = h
-	flgs.c = c
-	flgs.n = 1
-	flgs.z = z
+	v = alu.sub8_tbl[regs.a << 8 | ({0})]
+	regs.a = v & 0xff
+	flg(v >> 8)
 '''
 
 # SBC
 sbc_tmpl = '''
-	s, h, c, z = alu.sub8(regs.a, {0}, flgs.c)
-	regs.a = s
-	flgs.h = h
-	flgs.c = c
-	flgs.n = 1
-	flgs.z = z
+	v = alu.sub8_tbl[(flgs.val & 0x10) << 12 | ({0}) << 8 | ({1})]
+	{0} = v & 0xff
+	flg(v >> 8)
 '''
 
 # AND
 and_tmpl = '''
 	regs.a &= {}
-	flgs.z = z(regs.a)
-	flgs.n = 0
-	flgs.h = 1
-	flgs.c = 0
+	flg(not regs.a, 0, 1, 0)
 '''
 
 # OR
 or_tmpl = '''
 	regs.a |= {}
-	flgs.z = z(regs.a)
-	flgs.n = 0
-	flgs.h = 0
-	flgs.c = 0
+	flg(not regs.a, 0, 0, 0)
 '''
 
 # XOR
 xor_tmpl = '''
 	regs.a ^= {}
-	flgs.z = z(regs.a)
-	flgs.n = 0
-	flgs.h = 0
-	flgs.c = 0
+	flg(not regs.a, 0, 0, 0)
 '''
 
 # CP
 cp_tmpl = '''
-	_, h, c, z = alu.sub8(regs.a, {0})
-	flgs.z = z
-	flgs.n = 1
-	flgs.h = h
-	flgs.c = c
+	v = alu.sub8_tbl[regs.a << 8 | ({0})]
+	flg(v >> 8)
+'''
+
+# Lazy flag variants of the table-backed ops: the result is worked out
+# directly and F is left to LazyFlags, which only looks up the table entry
+# at {lz}[0][arg] when the flags are read
+
+# INC8 (lazy)
+inc8_lazy_tmpl = '''
+	x = {0}
+	{0} = (x + 1) & 0xff
+	if flgs.pend:
+		flgs.flush()
+	flgs.pend = {lz}
+	flgs.arg = x << 8 | 1
+'''
+
+# DEC8 (lazy)
+dec8_lazy_tmpl = '''
+	x = {0}
+	{0} = (x + 0xff) & 0xff
+	if flgs.pend:
+		flgs.flush()
+	flgs.pend = {lz}
+	flgs.arg = x << 8 | 1
+'''
+
+# ADD8 (lazy)
+add8_lazy_tmpl = '''
+	x = {0}
+	y = {1}
+	{0} = (x + y) & 0xff
+	flgs.pend = {lz}
+	flgs.arg = x << 8 | y
+'''
+
+# ADC8 (lazy)
+adc_lazy_tmpl = '''
+	c = flgs.val & 0x10
+	x = {0}
+	y = {1}
+	{0} = (x + y + (c >> 4)) & 0xff
+	flgs.pend = {lz}
+	flgs.arg = c << 12 | x << 8 | y
+'''
+
+# SUB (lazy)
+sub_lazy_tmpl = '''
+	x = regs.a
+	y = {0}
+	regs.a = (x - y) & 0xff
+	flgs.pend = {lz}
+	flgs.arg = x << 8 | y
+'''
+
+# SBC (lazy)
+sbc_lazy_tmpl = '''
+	c = flgs.val & 0x10
+	x = {0}
+	y = {1}
+	{0} = (x - y - (c >> 4)) & 0xff
+	flgs.pend = {lz}
+	flgs.arg = c << 12 | x << 8 | y
+'''
+
+# CP (lazy)
+cp_lazy_tmpl = '''
+	flgs.pend = {lz}
+	flgs.arg = regs.a << 8 | ({0})
 '''
 
 # PUSH
@@ -205,35 +233,25 @@ pop_tmpl = '''
 # SWAP
 swap_tmpl = '''
 	v = {0}
-	h = (v >> 8) & 0xf
-	l = v & 0xf
-	r = (l << 8) + h
+	r = ((v << 4) | (v >> 4)) & 0xff
 	{0} = r
-	flgs.z = z(r)
-	flgs.n = 0
-	flgs.h = 0
-	flgs.c = 0
+	flg(not r, 0, 0, 0)
 '''
 
 # CPL
 cpl_tmpl = '''
 	regs.a ^= 0xff
-	flgs.n = 0
-	flgs.h = 0
+	flg(_, 1, 1, _)
 '''
 
 # CCF
 ccf_tmpl = '''
-	flgs.c = not flgs.c
-	flgs.n = 0
-	flgs.h = 0
+	flg(_, 0, 0, not flgs.c)
 '''
 
 # SCF
 scf_tmpl = '''
-	flgs.c = 1
-	flgs.n = 0
-	flgs.h = 0
+	flg(_, 0, 0, 1)
 '''
 
 # HALT
@@ -249,31 +267,28 @@ stop_tmpl = '''
 # DI
 di_tmpl = '''
 	cpu.di = True
+	cpu.limit = 0
 '''
 
 # EI
 ei_tmpl = '''
 	cpu.ei = True
+	cpu.limit = 0
 '''
 
 # RLC
 rlc_tmpl = '''
 	v = {0}
-	flgs.c = v & 0x80
 	r = _rl(v, 8)
 	{0} = r
-	regs.f.z = z(r)
-	regs.f.n = 0
-	regs.f.h = 0
+	flg(not r, 0, 0, v & 0x80)
 '''
 
 # RLCA
 rlca_tmpl = '''
-	flgs.c = regs.a & 0x80
-	regs.a = _rl(regs.a, 8)
-	regs.f.z = 0
-	regs.f.n = 0
-	regs.f.h = 0
+	v = regs.a
+	regs.a = _rl(v, 8)
+	flg(0, 0, 0, v & 0x80)
 '''
 
 # RL
@@ -281,10 +296,7 @@ rl_tmpl = '''
 	v = {0} | (flgs.c << 8)
 	r = _rl(v, 9)
 	{0} = r & 0xff
-	flgs.c = r & 0x100
-	flgs.z = z(r)
-	flgs.n = 0
-	flgs.h = 0
+	flg(not r & 0xff, 0, 0, r & 0x100)
 '''
 
 # RLA
@@ -292,30 +304,22 @@ rla_tmpl = '''
 	v = regs.a | (flgs.c << 8)
 	r = _rl(v, 9)
 	regs.a = r & 0xff
-	flgs.c = r & 0x100
-	flgs.z = 0
-	flgs.n = 0
-	flgs.h = 0
+	flg(0, 0, 0, r & 0x100)
 '''
 
 # RRC
 rrc_tmpl = '''
 	v = {0}
-	flgs.c = v & 1
 	r = _rr(v, 8)
 	{0} = r
-	flgs.z = z(r)
-	flgs.n = 0
-	flgs.h = 0
+	flg(not r, 0, 0, v & 1)
 '''
 
 # RRCA
 rrca_tmpl = '''
-	flgs.c = regs.a & 1
-	regs.a = _rr(regs.a, 8)
-	flgs.z = 0
-	flgs.n = 0
-	flgs.h = 0
+	v = regs.a
+	regs.a = _rr(v, 8)
+	flg(0, 0, 0, v & 1)
 '''
 
 # RR
@@ -325,10 +329,7 @@ rr_tmpl = '''
 	v = _rr(v, 9)
 	y = (v >> 1) & 0xff
 	{0} = y
-	flgs.c = v & 1
-	flgs.z = z(y)
-	flgs.n = 0
-	flgs.h = 0
+	flg(not y, 0, 0, v & 1)
 '''
 
 # RRA
@@ -336,10 +337,7 @@ rra_tmpl = '''
 	v = regs.a << 1 | flgs.c
 	v = _rr(v, 9)
 	regs.a = (v >> 1) & 0xff
-	flgs.c = v & 1
-	flgs.z = 0
-	flgs.n = 0
-	flgs.h = 0
+	flg(0, 0, 0, v & 1)
 '''
 
 # SLA
@@ -369,9 +367,7 @@ daa_tmpl = '''
 
 # BIT
 bit_tmpl = '''
-	flgs.z = z({1} & 1 << {0})
-	regs.f.n = 0
-	regs.f.h = 1
+	flg(not ({1} & 1 << {0}), 0, 1, _)
 '''
 
 # SET
@@ -421,7 +417,7 @@ jrif_tmpl = '''
 
 # CALL x
 call_tmpl = '''
-	cpu.push(regs.pc + size)
+	cpu.call(regs.pc + size)
 	regs.pc = {}
 	cpu.time += time
 	return
@@ -430,7 +426,7 @@ call_tmpl = '''
 # CALL x,y
 callif_tmpl = '''
 	if {}:
-		cpu.push(regs.pc + size)
+		cpu.call(regs.pc + size)
 		regs.pc = {}
 		cpu.time += time[0]
 	else:
@@ -441,6 +437,7 @@ callif_tmpl = '''
 
 # RST
 rst_tmpl = '''
+	cpu.call(regs.pc + size)
 	regs.pc = {}
 	cpu.time += time
 	return
@@ -448,7 +445,7 @@ rst_tmpl = '''
 
 # RET
 ret_tmpl = '''
-	regs.pc = cpu.pop()
+	regs.pc = cpu.ret()
 	cpu.time += time
 	return
 '''
@@ -456,7 +453,7 @@ ret_tmpl = '''
 # RET x
 retif_tmpl = '''
 	if {}:
-		regs.pc = cpu.pop()
+		regs.pc = cpu.ret()
 		cpu.time += time[0]
 	else:
 		cpu.time += time[1]
@@ -466,14 +463,14 @@ retif_tmpl = '''
 
 # RETI
 reti_tmpl = '''
-	regs.pc = cpu.pop()
+	regs.pc = cpu.ret()
 	cpu.intr = True
 	cpu.time += time
 	return
 '''
 
 
-def _eval(s, bits=8):
+def _eval(s, bits=8, imm=None):
 	if isinstance(s, int):
 		return s
 
@@ -490,11 +487,15 @@ def _eval(s, bits=8):
 
 	if s.startswith('('):
 		s = s[1:-1]
-		return f'mc.as{bits}[{_eval(s, bits)}]'
+		return f'mc.as{bits}[{_eval(s, bits, imm)}]'
 
 	v = []
 	for i in s.split('+'):
-		if i == 'a8' or i == 'd8':
+		if imm is not None and i in ('a8', 'd8', 'a16', 'd16'):
+			v.append(f'0x{imm:02x}')
+		elif imm is not None and i == 'r8':
+			v.append(f'0x{alu.signed(imm):04x}')
+		elif i == 'a8' or i == 'd8':
 			v.append('mc.fetch()')
 		elif i == 'a16' or i == 'd16':
 			v.append('mc.fetch16()')
@@ -516,13 +517,14 @@ class Inst:
 		self.bits = d['bits'] or 16
 		self.time = d['time']
 		self.size = d['size']
+		self.flags = (d['z'], d['n'], d['h'], d['c'])
 
 	def suffix(self):
 		self.op = f'{self.op}{self.bits}'
 
 
-def _f(s, *args):
-	return s.format(*args)
+def _f(s, *args, **kwargs):
+	return s.format(*args, **kwargs)
 
 
 def _prepare(body):
@@ -534,70 +536,189 @@ def _prepare(body):
 	return s
 
 
-def _set_flag(s, f, v):
-	if f != '_':
-		if f != '0':
-			if f == '1':
-				s.append(f'0x{v:02x}')
-			else:
-				s.append(f'(0x{v:02x} if {f} else 0)')
-		return 0
-	else:
-		return v
+def _args(s):
+	# Split macro arguments on top-level commas
+	args = ['']
+	depth = 0
+	for ch in s:
+		if ch == ',' and depth == 0:
+			args.append('')
+			continue
+		if ch in '([':
+			depth += 1
+		elif ch in ')]':
+			depth -= 1
+		args[-1] += ch
+	return [a.strip() for a in args]
+
+
+def _masks(flags):
+	# F bits to keep from the old value and to take from a packed source. The
+	# low nibble of F is always zero, so an op that sets every flag never
+	# reads the old value
+	keep = 0
+	take = 0
+	for f, bit in zip(flags, (0x80, 0x40, 0x20, 0x10)):
+		if f == '-':
+			keep |= bit
+		else:
+			take |= bit
+	return keep, take
 
 
-def _expand_macro(body):
-	exp = r'flg\(([^,]*),([^,]*),([^,]*),([^,]*)\)'
-	m = re.search(exp, body)
+def _expand_macro(body, flags):
+	# flg(z, n, h, c) writes F once. Whether each flag is kept (-), cleared (0),
+	# set (1) or computed comes from the z/n/h/c columns of inst.yml; the macro
+	# only supplies the expressions for computed flags. flg(p) takes every
+	# non-kept flag from the packed F bits in p instead.
+	m = re.search(r'flg\((.*)\)$', body, re.M)
 	if m is None:
 		return body
-	z = m.group(1).strip()
-	n = m.group(2).strip()
-	h = m.group(3).strip()
-	c = m.group(4).strip()
-	s = []
-	m = 0
-	m |= _set_flag(s, z, 0x80)
-	m |= _set_flag(s, n, 0x40)
-	m |= _set_flag(s, h, 0x20)
-	m |= _set_flag(s, c, 0x10)
-	s = '|'.join(s)
-	return re.sub(exp, body, f'({s}) & 0x{m:02x}')
 
+	args = _args(m.group(1))
+	keep, take = _masks(flags)
+	ones = 0
+	terms = []
+	if len(args) > 1:
+		take = 0
+		for f, bit, a in zip(flags, (0x80, 0x40, 0x20, 0x10), args):
+			if f == '1':
+				ones |= bit
+			elif f not in ('-', '0'):
+				if a == '_':
+					raise Exception(f'no expression for flag {f}')
+				terms.append(f'(0x{bit:02x} if {a} else 0)')
+
+	s = []
+	if keep:
+		s.append(f'(flgs.val & 0x{keep:02x})')
+	if take == 0xf0:
+		s.append(f'({args[0]})')
+	elif take:
+		s.append(f'({args[0]} & 0x{take:02x})')
+	if ones:
+		s.append(f'0x{ones:02x}')
+	s += terms
+	return body[:m.start()] + f'flgs.val = {" | ".join(s) or "0"}' + body[m.end():]
+
+
+def _body(i, imm=None, lazy=False):
+	args = [_eval(a, i.bits, imm) for a in i.args]
+	if lazy and i.op in _lazy:
+		return _f(globals()[f'{i.op}_lazy_tmpl'], *args, lz=f'lz_{i.code:02x}')
 
-def _i(i, debug=False):
 	tmpl = globals()[f'{i.op}_tmpl']
-	body = _f(tmpl, *[_eval(a, i.bits) for a in i.args])
+	body = _f(tmpl, *args)
+	return _expand_macro(body, i.flags)
+
+
+def _i(i, debug=False, lazy=False):
+	body = _body(i, lazy=lazy)
 	prep = _prepare(body)
-	method = _f(base_tmpl, i.code, repr(i.size), repr(i.time), prep, body)
+	method = _f(base_tmpl, i.code, repr(i.size), repr(i.time), prep, body,
+	            'l' if lazy else '')
+	if lazy:
+		keep, take = _masks(i.flags)
+		method += f'\nlz_{i.code:02x} = (alu.{_lazy[i.op]}, 0x{keep:02x}, 0x{take:02x})\n'
 
 	if debug:
 		print(f'# {i.code:02x}: {i.op} {",".join([str(s) for s in i.args])}')
 		print(method)
 
-	exec(method, globals())
+	return method
 
-	if i.code > 0xff:
-		f = f'op_{i.code:04x}'
-	else:
-		f = f'op_{i.code:02x}'
-	ops[i.code] = globals()[f]
 
+def _unknown(code):
+	def op_unknown(cpu):
+		raise Exception(f'unknown op {code:02x}')
 
-ops = {}
-mnemonics = {}
+	return op_unknown
 
 
-def _load():
-	path = os.path.dirname(os.path.abspath(__file__))
+def op_cb(cpu):
+	mc = cpu.mc
+	i = mc.index
+	mc.index = i + 1
+	cb_ops[mc.ram[i]](cpu)
+
 
+ops = {}
+mnemonics = {}
+insts = {}
+
+# Flat dispatch tables indexed by opcode byte; 0xcb chains into the cb page
+base_ops = [None] * 256
+cb_ops = [None] * 256
+
+# Ops with a lazy flag variant and the table their flags come from.
+# lazy_ops is base_ops with those swapped in, for Cpu(lazy=True).
+_lazy = {
+    'inc8': 'add8_tbl',
+    'dec8': 'sub8_tbl',
+    'add8': 'add8_tbl',
+    'adc': 'add8_tbl',
+    'sub': 'sub8_tbl',
+    'sbc': 'sub8_tbl',
+    'cp': 'sub8_tbl',
+}
+lazy_ops = [None] * 256
+
+
+def _key(path):
+	h = hashlib.sha1()
+	for f in ('inst.yml', 'inst.py'):
+		with open(f'{path}/{f}', 'rb') as f:
+			h.update(f.read())
+	return h.hexdigest()
+
+
+def _read_cache(cache, key):
+	try:
+		with open(cache, 'rb') as f:
+			k, data, code = marshal.load(f)
+	except (OSError, EOFError, ValueError, TypeError):
+		return None, None
+
+	if k != key:
+		return None, None
+	return data, code
+
+
+def _write_cache(cache, key, data, code):
+	try:
+		os.makedirs(os.path.dirname(cache), exist_ok=True)
+		tmp = f'{cache}.{os.getpid()}'
+		with open(tmp, 'wb') as f:
+			marshal.dump((key, data, code), f)
+		os.replace(tmp, cache)
+	except OSError as e:
+		print(f'Cannot write {cache}: {e}')
+
+
+def _parse(path):
+	import yaml
+
+	loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 	with open(f'{path}/inst.yml', 'r') as f:
 		try:
-			insts = yaml.load(f.read())
+			return yaml.load(f.read(), Loader=loader)
 		except yaml.YAMLError as e:
 			print(f'{e}')
 
-	for i in insts:
+
+def _load():
+	# Generated handlers are cached as one marshalled code object, keyed on
+	# the contents of inst.yml and this file
+	path = os.path.dirname(os.path.abspath(__file__))
+	key = _key(path)
+	cache = f'{path}/__pycache__/inst.{sys.implementation.cache_tag}.ops'
+
+	data, code = _read_cache(cache, key)
+	if data is None:
+		data = _parse(path)
+
+	methods = []
+	for i in data:
 		i = Inst(i)
 
 		if i.op == 'prefix':
@@ -610,22 +731,177 @@ def _load():
 
 		if i.code == 0xe8:
 			i.op = 'addsp'
-			_i(i)
 		elif i.op == 'inc' or i.op == 'dec' or i.op == 'add':
 			i.suffix()
-			_i(i)
 		elif isinstance(i.time, list):
 			i.op = f'{i.op}if'
-			_i(i)
+
+		if code is None:
+			methods.append(_i(i))
+			if i.op in _lazy:
+				methods.append(_i(i, lazy=True))
+
+		insts[i.code] = i
+
+	if code is None:
+		code = compile(''.join(methods), '<inst>', 'exec')
+		_write_cache(cache, key, data, code)
+
+	exec(code, globals())
+
+	for c, i in insts.items():
+		if c > 0xff:
+			f = globals()[f'op_{c:04x}']
+			cb_ops[c & 0xff] = f
 		else:
-			_i(i)
+			f = globals()[f'op_{c:02x}']
+			base_ops[c] = f
+		ops[c] = f
+
+	for c in range(256):
+		if base_ops[c] is None:
+			base_ops[c] = _unknown(c)
+		if cb_ops[c] is None:
+			cb_ops[c] = _unknown(0xcb00 | c)
+	base_ops[0xcb] = op_cb
+
+	lazy_ops[:] = base_ops
+	for c, i in insts.items():
+		if i.op in _lazy:
+			lazy_ops[c] = globals()[f'lop_{c:02x}']
 
 
 def op(cpu, op, debugger=None):
 	if debugger:
-		debugger.on_decode(op, f'{mnemonics.get(op, "unkown op")}')
+		debugger.on_decode(op, mnemonics.get(op, 'unknown op'))
 
-	ops[op](cpu)
+	if op > 0xff:
+		ops[op](cpu)
+	else:
+		cpu.ops[op](cpu)
+
+
+# Ops that end a basic block; they run through the normal handler
+_terms = ('jp', 'jpif', 'jr', 'jrif', 'call', 'callif', 'ret', 'retif', 'reti',
+          'rst', 'halt', 'stop', 'ei', 'di')
+
+
+def _localize(body):
+	# Rewrite a handler body so registers live in locals (_a, _b, ..., _sp)
+	lines = []
+	for l in body.split('\n'):
+		m = re.match(r'(\s*)regs\.(af|bc|de|hl) = (.*)$', l)
+		if m:
+			ind, p, v = m.groups()
+			hi = 'regs.a' if p == 'af' else f'regs.{p[0]}'
+			lo = 'regs.f.val' if p == 'af' else f'regs.{p[1]}'
+			mask = '0xf0' if p == 'af' else '0xff'
+			lines.append(f'{ind}v_ = {v}')
+			lines.append(f'{ind}{hi} = (v_ >> 8) & 0xff')
+			lines.append(f'{ind}{lo} = v_ & {mask}')
+		else:
+			lines.append(l)
+	body = '\n'.join(lines)
+
+	body = re.sub(r'regs\.af\b', '(regs.a << 8 | regs.f.val)', body)
+	body = re.sub(r'regs\.(b|d|h)(c|e|l)\b', r'(regs.\1 << 8 | regs.\2)', body)
+	body = body.replace('regs.f.', 'flgs.')
+	body = re.sub(r'regs\.(a|b|c|d|e|h|l|sp)\b', r'_\1', body)
+
+	# push/pop work on regs.sp
+	lines = []
+	for l in body.split('\n'):
+		if re.search(r'cpu\.(push|pop|call|ret)\(', l):
+			ind = l[:len(l) - len(l.lstrip())]
+			lines += [f'{ind}regs.sp = _sp', l, f'{ind}_sp = regs.sp']
+		else:
+			lines.append(l)
+	return '\n'.join(lines)
+
+
+def block(ram, pc, limit=32, lazy=False):
+	start = pc
+	lines = []
+	time = 0
+	term = 0
+	count = 0
+
+	for _ in range(limit):
+		if pc > 0xfffc:
+			term = 1
+			break
+
+		code = ram[pc]
+		if code == 0xcb:
+			code = 0xcb00 | ram[pc + 1]
+		i = insts.get(code)
+		if i is None or i.op in _terms:
+			term = i.size if i else 1
+			break
+
+		imm = None
+		if code <= 0xff and i.size > 1:
+			imm = ram[pc + 1]
+			if i.size > 2:
+				imm |= ram[pc + 2] << 8
+
+		body = _body(i, imm, lazy)
+		if 'raise' in body:
+			term = i.size
+			break
+		body = _localize(body)
+
+		# Keep cpu.time exact for anything that can reach the memory hooks
+		if time and ('mc.' in body or 'cpu.' in body):
+			lines.append(f'\tcpu.time += {time}')
+			time = 0
+		lines.append(body)
+		time += i.time
+		pc += i.size
+		count += 1
+
+		# A store may have hit compiled code, this block included; if so
+		# stop here and let dispatch pick up the new code
+		if re.search(r'mc\.as(8|16)\[.*\] =(?!=)|cpu\.push\(', body):
+			lines.append(f'\tif blocks.stale:\n\t\t#exit {pc} {time} {count}')
+
+	text = '\n'.join(lines)
+	used = sorted(set(re.findall(r'\b_(a|b|c|d|e|h|l|sp)\b', text)))
+	written = set(
+	    re.findall(r'^\s*_(a|b|c|d|e|h|l|sp)\s*[-+&|^]?=(?!=)', text, re.M))
+
+	head = ['\tregs = cpu.regs']
+	if 'mc.' in text or term:
+		head.append('\tmc = cpu.mc')
+	if 'flgs' in text:
+		head.append('\tflgs = regs.f')
+	if 'blocks.' in text:
+		head.append('\tblocks = cpu.blocks')
+	head += [f'\t_{r} = regs.{r}' for r in used]
+
+	tail = [f'\tregs.{r} = _{r}' for r in used if r in written]
+
+	def exit(m):
+		p, t, n = map(int, m.groups())
+		ret = ['blocks.stale = False'] + [l.strip() for l in tail]
+		ret += [f'regs.pc = 0x{p:04x}', f'cpu.time += {t}', f'cpu.insts += {n}', 'return']
+		return '\n'.join('\t\t' + l for l in ret)
+
+	text = re.sub(r'\t\t#exit (\d+) (\d+) (\d+)', exit, text)
+	tail.append(f'\tregs.pc = 0x{pc:04x}')
+	if time:
+		tail.append(f'\tcpu.time += {time}')
+	tail.append(f'\tcpu.insts += {count + (term > 0)}')
+
+	if term:
+		# Hand over to the handler of the op that ends the block
+		tail.append(f'\tmc.index = 0x{pc + 1:04x}')
+		tail.append(f'\tbase_ops[0x{ram[pc]:02x}](cpu)')
+
+	src = f'def block_{start:04x}(cpu):\n' + '\n'.join(head + [text] + tail)
+	ns = {}
+	exec(src, globals(), ns)
+	return ns[f'block_{start:04x}'], pc + term
 
 
 _load()
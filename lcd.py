@@ -0,0 +1,41 @@
+from scene import *
+
+from display import Display
+
+
+class Lcd(Scene, Display):
+	# Pythonista scene drawing the framebuffer as scaled rects. Scene comes
+	# first, so Display's hooks must not reuse Node names such as frame.
+	def __init__(self, on_frame=None):
+		Scene.__init__(self)
+		Display.__init__(self, on_frame)
+
+	def setup(self):
+		self.background_color = 'white'
+
+	def draw(self):
+		#return
+		sw, sh = self.size
+		s = 2
+		xoff = (sw - self.width * s) // 2
+		yoff = 30  # sh - self.height * s - 30
+
+		#image(self.imgid, xoff, yoff, self.width * s, self.height * s)
+		#return
+
+		w = self.width
+		h = self.height
+		vram = self.vram
+		lut = self.lut
+
+		for x in range(w):
+			for y in range(h):
+				i = x + y * w
+				px = x * s + xoff
+				py = sh - y * s - yoff
+
+				fill(lut[vram[i]])
+				rect(px, py, s, s)
+
+	def show(self):
+		run(self, orientation=PORTRAIT, frame_interval=3)
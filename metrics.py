@@ -0,0 +1,117 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+# Emulated clock and cycles per frame
+CLOCK = 4194304
+FRAME = 70224
+
+SUBSYSTEMS = ('cpu', 'ppu', 'mmu', 'sched', 'debugger', 'other')
+
+# Source files by subsystem; compiled blocks are exec'd from '<string>'
+_modules = {
+    'cpu.py': 'cpu',
+    'inst.py': 'cpu',
+    '<inst>': 'cpu',
+    '<string>': 'cpu',
+    'block.py': 'cpu',
+    'alu.py': 'cpu',
+    'gpu.py': 'ppu',
+    'display.py': 'ppu',
+    'lcd.py': 'ppu',
+    'mmu.py': 'mmu',
+    'sched.py': 'sched',
+    'debug.py': 'debugger',
+    'tracer.py': 'debugger',
+    'profiler.py': 'debugger',
+}
+
+
+class Metrics(object):
+	# Where host time goes, estimated from a thread that samples the emulator
+	# thread's stack every interval and counts a sample against the innermost
+	# emulator module. A subsystem's share of the samples estimates its share
+	# of the time, with a standard error of sqrt(p * (1 - p) / samples); its
+	# estimated time is that share of the wall time the sampler covered. The
+	# sampler only runs when the GIL lets it, so samples bunch at switch
+	# points and short-lived work is under-counted. Every `every` frames a
+	# scheduler event reports fps, ips and speed against real hardware and
+	# the estimates so far, optionally as json lines.
+	def __init__(self, cpu, every=60, path=None, interval=0.001, out=print):
+		self.cpu = cpu
+		self.every = every
+		self.interval = interval
+		self.out = out
+		self.f = open(path, 'a') if path else None
+		self.counts = dict.fromkeys(SUBSYSTEMS, 0)
+		self.sampled_ns = 0
+		self.tid = None
+		self.thread = None
+		self.running = False
+		self.event = None
+
+	def start(self):
+		self.tid = threading.get_ident()
+		self.mark = (time.perf_counter_ns(), self.cpu.time, self.cpu.insts)
+		self.event = self.cpu.sched.after(FRAME * self.every, self.report)
+		self.running = True
+		self.thread = threading.Thread(target=self.sample, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		self.cpu.sched.cancel(self.event)
+		if self.thread:
+			self.thread.join()
+		if self.f:
+			self.f.close()
+			self.f = None
+
+	def sample(self):
+		last = time.perf_counter_ns()
+		while self.running:
+			time.sleep(self.interval)
+			now = time.perf_counter_ns()
+			s = self.classify(sys._current_frames().get(self.tid))
+			self.counts[s] += 1
+			self.sampled_ns += now - last
+			last = now
+
+	def classify(self, frame):
+		while frame:
+			s = _modules.get(os.path.basename(frame.f_code.co_filename))
+			if s:
+				return s
+			frame = frame.f_back
+		return 'other'
+
+	def report(self, t):
+		now = time.perf_counter_ns()
+		ns, cycles, insts = self.mark
+		secs = (now - ns) / 1e9 or 1e-9
+		self.mark = (now, t, self.cpu.insts)
+
+		n = sum(self.counts.values())
+		share = {s: c / (n or 1) for s, c in self.counts.items()}
+		sample = {
+		    'time': t,
+		    'fps': (t - cycles) / FRAME / secs,
+		    'ips': (self.cpu.insts - insts) / secs,
+		    'realtime': 100 * (t - cycles) / CLOCK / secs,
+		    'samples': dict(self.counts),
+		    'share': share,
+		    'stderr': {s: math.sqrt(p * (1 - p) / (n or 1)) for s, p in share.items()},
+		    'est_ns': {s: round(p * self.sampled_ns) for s, p in share.items()},
+		}
+		parts = ' '.join(f'{s} {100 * p:.0f}±{100 * sample["stderr"][s]:.0f}%'
+		                 for s, p in share.items() if p)
+		self.out(f'{sample["fps"]:.1f} fps, {sample["ips"]:.0f} ips, '
+		         f'{sample["realtime"]:.0f}% realtime; {n} samples: {parts}')
+		if self.f:
+			self.f.write(json.dumps(sample) + '\n')
+			self.f.flush()
+
+		self.event = self.cpu.sched.at(t + FRAME * self.every, self.report)
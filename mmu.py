@@ -1,3 +1,6 @@
+import os
+
+
 def load(f):
 	with open(f, 'rb') as f:
 		return f.read()
@@ -6,47 +9,100 @@ def load(f):
 class MemCtrl(object):
 	def __init__(self, debugger=None):
 		self.ram = bytearray([0] * 0x10000)
-		boot = load('boot.bin')
+		boot = load(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'boot.bin'))
 		self.ram[0:len(boot)] = bytearray(boot)
 		self.ram[0x0104:48] = bytearray(boot)[0x00a8:]
-		self.rdhooks = {}
-		self.wrhooks = {}
+		# Hooks live in 256 pages of 256 slots. A page is None until a hook
+		# lands in it, so plain RAM never gets past the page lookup.
+		self.rdpages = [None] * 0x100
+		self.wrpages = [None] * 0x100
+		self.code = bytearray(0x10000)
+		self.on_code_write = None
 		self.debugger = debugger
-
-	def add_hook(self, hooks, addr, handler):
+		# The debugger as seen by the access paths; None while it watches nothing
+		self.dbg = debugger
+		self.rdwatch = self.wrwatch = b'\x01' * 0x100
+
+	def watch(self, dbg):
+		# Report accesses to dbg, only on the pages it marks in rpages/wpages
+		# if it has them
+		self.dbg = dbg
+		self.rdwatch = getattr(dbg, 'rpages', b'\x01' * 0x100)
+		self.wrwatch = getattr(dbg, 'wpages', b'\x01' * 0x100)
+
+	def add_hook(self, pages, addr, handler):
 		if isinstance(addr, tuple):
-			for a in range(addr[0], addr[1]):
-				hooks[a] = handler
+			lo, hi = addr
 		else:
-			hooks[addr] = handler
+			lo, hi = addr, addr + 1
+
+		while lo < hi:
+			p = lo >> 8
+			end = min(hi, (p + 1) << 8)
+			if pages[p] is None:
+				pages[p] = [None] * 0x100
+			pages[p][lo & 0xff:((end - 1) & 0xff) + 1] = [handler] * (end - lo)
+			lo = end
 
 	def add_rdhook(self, addr, handler):
-		self.add_hook(self.rdhooks, addr, handler)
+		self.add_hook(self.rdpages, addr, handler)
 
 	def add_wrhook(self, addr, handler):
-		self.add_hook(self.wrhooks, addr, handler)
+		self.add_hook(self.wrpages, addr, handler)
 
 	def __getitem__(self, addr):
-		if self.debugger:
-			self.debugger.on_read(addr, self.ram[addr])
+		if self.dbg and self.rdwatch[addr >> 8]:
+			self.dbg.on_read(addr, self.ram[addr])
 
-		if addr in self.rdhooks:
-			val = self.rdhooks[addr](addr)
-			if val:
-				return val
+		page = self.rdpages[addr >> 8]
+		if page:
+			hook = page[addr & 0xff]
+			if hook:
+				val = hook(addr)
+				if val:
+					return val
 
 		return self.ram[addr]
 
 	def __setitem__(self, addr, val):
-		if self.debugger:
-			self.debugger.on_write(addr, val)
+		if self.dbg and self.wrwatch[addr >> 8]:
+			self.dbg.on_write(addr, val)
 
-		if addr in self.wrhooks:
-			if self.wrhooks[addr](addr, val):
+		page = self.wrpages[addr >> 8]
+		if page:
+			hook = page[addr & 0xff]
+			if hook and hook(addr, val):
 				return
 
+		if self.code[addr]:
+			self.on_code_write(addr)
+
 		self.ram[addr] = val & 0xff
 
+	def read16(self, addr):
+		hi = (addr + 1) & 0xffff
+		rdpages = self.rdpages
+		if rdpages[addr >> 8] or rdpages[hi >> 8] or self.dbg and (
+		    self.rdwatch[addr >> 8] or self.rdwatch[hi >> 8]):
+			return self[addr] | self[hi] << 8
+
+		ram = self.ram
+		return ram[addr] | ram[hi] << 8
+
+	def write16(self, addr, val):
+		hi = (addr + 1) & 0xffff
+		wrpages = self.wrpages
+		code = self.code
+		if wrpages[addr >> 8] or wrpages[hi >> 8] or code[addr] or code[
+		    hi] or self.dbg and (self.wrwatch[addr >> 8] or self.wrwatch[hi >> 8]):
+			self[addr] = val & 0xff
+			self[hi] = (val >> 8) & 0xff
+			return
+
+		ram = self.ram
+		ram[addr] = val & 0xff
+		ram[hi] = (val >> 8) & 0xff
+
 
 class MemAccessor(object):
 	def __init__(self, mc, unit):
@@ -64,13 +120,32 @@ class MemAccessor(object):
 			self.mc[addr + i] = (val >> (i * 8)) & 0xff
 
 
+class WordAccessor(object):
+	# Little-endian words straight from MemCtrl, hooks permitting
+	def __init__(self, mc):
+		self.read16 = mc.read16
+		self.write16 = mc.write16
+
+	def __getitem__(self, addr):
+		return self.read16(addr)
+
+	def __setitem__(self, addr, val):
+		self.write16(addr, val)
+
+
 class MemFetcher(object):
 	def __init__(self, mc, debugger=None):
 		self.mc = mc
-		self.as8 = MemAccessor(mc, 1)
-		self.as16 = MemAccessor(mc, 2)
+		self.ram = getattr(mc, 'ram', mc)
+		if hasattr(mc, 'read16'):
+			self.as8 = mc
+			self.as16 = WordAccessor(mc)
+		else:
+			self.as8 = MemAccessor(mc, 1)
+			self.as16 = MemAccessor(mc, 2)
 		self.index = 0
 		self.debugger = debugger
+		self.dbg = debugger
 
 	def __getitem__(self, addr):
 		return self.mc[addr]
@@ -84,12 +159,17 @@ class MemFetcher(object):
 	def fetch(self):
 		b = self.mc[self.index]
 
-		if self.debugger:
-			self.debugger.on_fetch(self, self.index, b)
+		if self.dbg:
+			self.dbg.on_fetch(self, self.index, b)
 
 		self.index += 1
 		return b
 
 	def fetch16(self):
-		a = self.fetch()
-		return (self.fetch() << 8) | a
+		if self.dbg:
+			a = self.fetch()
+			return (self.fetch() << 8) | a
+
+		i = self.index
+		self.index = i + 2
+		return self.as16[i]
@@ -0,0 +1,142 @@
+import collections
+import csv
+import json
+
+from array import array
+
+import inst
+
+
+def _mnem(op):
+	code = 0xcb00 | (op & 0xff) if op > 0xff else op
+	return inst.mnemonics.get(code, 'unknown op')
+
+
+class OpProfile(object):
+	# Executions and cycles per opcode (0x100 + n for cb n) and hits per pc,
+	# counted between before() and after() around each instruction
+	def __init__(self):
+		self.counts = array('Q', bytes(8 * 0x200))
+		self.cycles = array('Q', bytes(8 * 0x200))
+		self.hits = array('Q', bytes(8 * 0x10000))
+		self.op = 0
+		self.time = 0
+
+	def before(self, cpu):
+		pc = cpu.regs.pc
+		ram = cpu.mc.ram
+		op = ram[pc]
+		if op == 0xcb:
+			op = 0x100 | ram[(pc + 1) & 0xffff]
+		self.op = op
+		self.time = cpu.time
+		self.hits[pc] += 1
+
+	def after(self, cpu):
+		op = self.op
+		self.counts[op] += 1
+		self.cycles[op] += cpu.time - self.time
+
+	def ops(self):
+		return sorted(((op, self.counts[op], self.cycles[op])
+		               for op in range(0x200) if self.counts[op]),
+		              key=lambda o: -o[2])
+
+	def pcs(self):
+		return sorted(((pc, n) for pc, n in enumerate(self.hits) if n),
+		              key=lambda p: -p[1])
+
+	def report(self, n=20):
+		total = sum(self.cycles) or 1
+		lines = [f'{"op":>6} {"mnemonic":<16} {"count":>10} {"cycles":>12} {"%":>6}']
+		for op, count, cycles in self.ops()[:n]:
+			code = f'cb{op & 0xff:02x}' if op > 0xff else f'{op:02x}'
+			lines.append(f'{code:>6} {_mnem(op):<16} {count:>10} {cycles:>12} '
+			             f'{100 * cycles / total:>6.2f}')
+		lines.append(f'{"pc":>6} {"hits":>10}')
+		for pc, hits in self.pcs()[:n]:
+			lines.append(f'{pc:>6x} {hits:>10}')
+		return '\n'.join(lines)
+
+	def export(self, path):
+		ops = [{
+		    'op': op,
+		    'mnemonic': _mnem(op),
+		    'count': count,
+		    'cycles': cycles
+		} for op, count, cycles in self.ops()]
+		pcs = [{'pc': pc, 'hits': hits} for pc, hits in self.pcs()]
+
+		with open(path, 'w', newline='') as f:
+			if path.endswith('.json'):
+				json.dump({'ops': ops, 'pcs': pcs}, f, indent=1)
+				return
+
+			w = csv.writer(f)
+			w.writerow(['kind', 'addr', 'mnemonic', 'count', 'cycles'])
+			for o in ops:
+				w.writerow(['op', o['op'], o['mnemonic'], o['count'], o['cycles']])
+			for p in pcs:
+				w.writerow(['pc', p['pc'], '', p['hits'], ''])
+
+
+class StackSampler(object):
+	# Every `every` emulated cycles, counts the current pc under a shadow call
+	# stack of call sites kept by wrapping cpu.call and cpu.ret
+	def __init__(self, cpu, every=1000, syms=None, depth=64):
+		self.cpu = cpu
+		self.every = every
+		self.syms = syms
+		self.depth = depth
+		self.stack = []
+		self.samples = collections.Counter()
+		self.event = None
+
+	def start(self):
+		cpu = self.cpu
+		stack = self.stack
+		push = type(cpu).call
+		pop = type(cpu).ret
+
+		def call(v):
+			if len(stack) == self.depth:
+				del stack[0]
+			stack.append(cpu.regs.pc)
+			push(cpu, v)
+
+		def ret():
+			if stack:
+				stack.pop()
+			return pop(cpu)
+
+		cpu.call = call
+		cpu.ret = ret
+		self.event = cpu.sched.after(self.every, self.sample)
+
+	def stop(self):
+		del self.cpu.call
+		del self.cpu.ret
+		self.cpu.sched.cancel(self.event)
+
+	def sample(self, t):
+		self.samples[tuple(self.stack) + (self.cpu.regs.pc, )] += 1
+		self.event = self.cpu.sched.at(t + self.every, self.sample)
+
+	def func(self, addr):
+		if self.syms:
+			name, _ = self.syms.lookup(addr)
+			if name:
+				return name
+		return f'{addr:04x}'
+
+	def collapsed(self):
+		# One 'outer;inner;leaf count' line per distinct stack, for flamegraphs
+		stacks = collections.Counter()
+		for key, n in self.samples.items():
+			stacks[';'.join(self.func(a) for a in key)] += n
+		return [f'{s} {n}' for s, n in sorted(stacks.items())]
+
+	def write(self, path):
+		with open(path, 'w') as f:
+			for l in self.collapsed():
+				f.write(l + '\n')
@@ -0,0 +1,48 @@
+import heapq
+
+INF = float('inf')
+
+
+class Scheduler(object):
+	def __init__(self, cpu):
+		self.cpu = cpu
+		self.events = []
+		self.seq = 0
+		self.next = INF
+
+	@property
+	def now(self):
+		return self.cpu.time
+
+	def at(self, time, handler):
+		ev = [time, self.seq, handler]
+		self.seq += 1
+		heapq.heappush(self.events, ev)
+
+		if time < self.next:
+			self.next = time
+			# pull in the end of a batch that is already running
+			if time < self.cpu.limit:
+				self.cpu.limit = time
+		return ev
+
+	def after(self, clks, handler):
+		return self.at(self.cpu.time + clks, handler)
+
+	def cancel(self, ev):
+		if ev:
+			ev[2] = None
+
+	def run(self):
+		events = self.events
+		now = self.cpu.time
+
+		while events and events[0][0] <= now:
+			time, _, handler = heapq.heappop(events)
+			if handler:
+				handler(time)
+
+		while events and events[0][2] is None:
+			heapq.heappop(events)
+
+		self.next = events[0][0] if events else INF
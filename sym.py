@@ -0,0 +1,41 @@
+import bisect
+
+
+class Symbols(object):
+	# Labels from RGBDS .sym files ('BB:AAAA Name'), sorted by address so the
+	# enclosing label of an address is one bisect away
+	def __init__(self, path=None, bank=1):
+		self.addrs = []
+		self.names = []
+		if path:
+			self.load(path, bank)
+
+	def load(self, path, bank=1):
+		# Without a mapper only one ROMX bank is visible at 4000-7fff
+		syms = dict(zip(self.addrs, self.names))
+		with open(path, 'r') as f:
+			for l in f:
+				l = l.split(';', 1)[0].split()
+				if len(l) < 2 or ':' not in l[0]:
+					continue
+				b, a = l[0].split(':')
+				b = int(b, 16)
+				a = int(a, 16)
+				if 0x4000 <= a < 0x8000 and b != bank:
+					continue
+				syms.setdefault(a, l[1])
+
+		self.addrs = sorted(syms)
+		self.names = [syms[a] for a in self.addrs]
+
+	def lookup(self, addr):
+		i = bisect.bisect_right(self.addrs, addr) - 1
+		if i < 0:
+			return None, addr
+		return self.names[i], addr - self.addrs[i]
+
+	def name(self, addr):
+		name, off = self.lookup(addr)
+		if name is None:
+			return f'{addr:04x}'
+		return f'{name}+{off:x}' if off else name
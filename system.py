@@ -1,25 +1,49 @@
+import argparse
+
 from cpu import Cpu, MemCtrl
 from gpu import Gpu
+from display import Headless
 from debug import DebugShell
+from metrics import Metrics
 
 
 def main():
+	p = argparse.ArgumentParser()
+	p.add_argument('--metrics', type=int, metavar='FRAMES',
+	               help='report speed and sampled host time per subsystem every FRAMES frames')
+	p.add_argument('--metrics-file', help='append metrics samples as json lines')
+	p.add_argument('--headless', action='store_true',
+	               help='run without a window')
+	p.add_argument('--numpy', action='store_true',
+	               help='render with numpy when it is installed')
+	args = p.parse_args()
+
 	print('Starting gb...')
 
 	dbg = DebugShell(init=True)
 
 	mc = MemCtrl(debugger=dbg)
 
-	cpu = Cpu(mc, debugger=dbg)
+	cpu = Cpu(mc, debugger=dbg, blocks=True)
 
-	gpu = Gpu(mc, debugger=dbg, show=True)
+	if args.headless:
+		display = Headless()
+	else:
+		from lcd import Lcd
+		display = Lcd()
+
+	gpu = Gpu(mc, cpu.sched, debugger=dbg, display=display, vectorize=args.numpy)
 
 	cpu.setup()
 	gpu.setup()
 
+	if args.metrics:
+		Metrics(cpu, args.metrics, args.metrics_file).start()
+
+	sched = cpu.sched
 	while True:
-		clk = cpu.step()
-		gpu.step(clk)
+		cpu.run(sched.next - cpu.time)
+		sched.run()
 
 
 if __name__ == '__main__':
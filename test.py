@@ -1,6 +1,6 @@
 import unittest
 
-tests = ['alu', 'cpu']
+tests = ['alu', 'cover', 'cpu', 'debug', 'doctor', 'gpu', 'metrics', 'mmu', 'profiler', 'sym', 'tracer']
 tests = [f'test.test_{t}' for t in tests]
 tests = [unittest.defaultTestLoader.loadTestsFromName(t) for t in tests]
 tests = unittest.TestSuite(tests)
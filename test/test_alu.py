@@ -71,6 +71,18 @@ class AluTest(unittest.TestCase):
 		v = alu.add16e(0xffed, 0xff)
 		self.assertEqual(v, (0xffec, True, True, False))
 
+	def test_tables(self):
+		for c in (0, 1):
+			for p in range(0, 256, 5):
+				for q in range(256):
+					s, h, cy, z = alu._add(8, p, q, c)
+					f = z << 7 | h << 5 | cy << 4
+					self.assertEqual(alu.add8_tbl[c << 16 | p << 8 | q], f << 8 | s)
+
+					s, h, cy, z = alu._sub(8, p, q, c)
+					f = z << 7 | 1 << 6 | h << 5 | cy << 4
+					self.assertEqual(alu.sub8_tbl[c << 16 | p << 8 | q], f << 8 | s)
+
 
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+
+import cover
+import sym
+from cpu import Cpu
+from mmu import MemCtrl, MemFetcher
+
+
+class TestCover(unittest.TestCase):
+	def _run(self, cycles, blocks=False):
+		mc = MemCtrl()
+		cpu = Cpu(mc, blocks=blocks)
+		cov = cover.Coverage()
+		cov.attach(cpu)
+		while cpu.time < cycles:
+			cpu.run(cycles - cpu.time)
+		return cpu, mc, cov
+
+	def test_marks(self):
+		cpu, mc, cov = self._run(300000, blocks=True)
+		self.assertIsInstance(mc, cover.CoveredMemCtrl)
+		# ld sp,d16; xor a; ld hl,d16; ld (hl-),a; bit 7,h; jr nz
+		self.assertEqual(cov.x[0:0x0c], b'\x01' * 0x0c)
+		self.assertEqual(cov.w[0x8000:0xa000], b'\x01' * 0x2000)
+		self.assertEqual(cov.r[0:0x0c], bytes(0x0c))
+		self.assertEqual(cov.w[0xfffc:0xfffe], b'\x01\x01')
+
+		cov.detach(cpu)
+		self.assertIs(type(mc), MemCtrl)
+		self.assertIs(type(cpu.mc), MemFetcher)
+		x = bytes(cov.x)
+		cpu.run(10000)
+		self.assertEqual(bytes(cov.x), x)
+
+	def test_fetch_hooks(self):
+		# Operands of ld sp,d16 still go through read hooks
+		mc = MemCtrl()
+		mc.add_rdhook((0x0001, 0x0003), lambda addr: 0xc0 if addr == 2 else 0x10)
+		cpu = Cpu(mc)
+		cov = cover.Coverage()
+		cov.attach(cpu)
+		cpu.step()
+		self.assertEqual(cpu.regs.sp, 0xc010)
+		self.assertEqual(cov.x[0:3], b'\x01' * 3)
+		self.assertEqual(cov.r[0:3], bytes(3))
+
+	def test_wrap(self):
+		# cb 00 at ffff wraps its second byte to 0000
+		for run in (True, False):
+			mc = MemCtrl()
+			cpu = Cpu(mc)
+			cov = cover.Coverage()
+			cov.attach(cpu)
+			mc.ram[0xffff] = 0xcb
+			mc.ram[0x0000] = 0x00
+			cpu.regs.pc = 0xffff
+			if run:
+				cpu.run(1)
+			else:
+				cpu.step()
+			self.assertEqual(cov.x[0xffff], 1)
+			self.assertEqual(cov.x[0x0000], 1)
+
+	def test_files(self):
+		cpu, mc, cov = self._run(1000)
+		syms = sym.Symbols()
+		syms.addrs = [0x0000, 0x000c, 0x0100]
+		syms.names = ['Clear', 'Sound', 'Cart']
+		with tempfile.TemporaryDirectory() as d:
+			path = os.path.join(d, 'cov.bin')
+			cov.save(path)
+			self.assertEqual(os.path.getsize(path), len(cover.MAGIC) + 3 * 0x2000)
+			other = cover.Coverage()
+			other.load(path)
+			self.assertEqual((other.x, other.r, other.w), (cov.x, cov.r, cov.w))
+
+			path = os.path.join(d, 'cov.info')
+			cov.lcov(path, syms)
+			with open(path) as f:
+				info = f.read().split('\n')
+		self.assertEqual(cov.summary(syms)[:2], [('Clear', 0, 0x0c, 0x0c),
+		                                         ('Sound', 0x0c, 0x100, 0)])
+		self.assertIn('FNDA:1,Clear', info)
+		self.assertIn('FNDA:0,Sound', info)
+		self.assertIn('DA:11,1', info)
+		self.assertIn('LH:12', info)
+
+
+if __name__ == '__main__':
+	unittest.main()
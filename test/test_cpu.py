@@ -1,6 +1,7 @@
 import unittest
 
 from cpu import Cpu, MemFetcher
+from mmu import MemCtrl
 
 
 class TestCpu(unittest.TestCase):
@@ -514,13 +515,14 @@ class TestCpu(unittest.TestCase):
 		cpu.regs.de = 0x4455
 		cpu.regs.hl = 0x6677
 
-		self.assertEqual(cpu.regs.af, 0x1122)
+		# the low nibble of F always reads as zero
+		self.assertEqual(cpu.regs.af, 0x1120)
 		self.assertEqual(cpu.regs.bc, 0x2233)
 		self.assertEqual(cpu.regs.de, 0x4455)
 		self.assertEqual(cpu.regs.hl, 0x6677)
 
 		cpu.decode()
-		self.assertEqual(cpu.mc[0x1002], 0x22)
+		self.assertEqual(cpu.mc[0x1002], 0x20)
 		self.assertEqual(cpu.mc[0x1003], 0x11)
 		cpu.decode()
 		self.assertEqual(cpu.mc[0x1000], 0x33)
@@ -533,13 +535,13 @@ class TestCpu(unittest.TestCase):
 		self.assertEqual(cpu.mc[0x0ffd], 0x66)
 
 		cpu.decode()
-		self.assertEqual(cpu.regs.af, 0x6677)
+		self.assertEqual(cpu.regs.af, 0x6670)
 		cpu.decode()
 		self.assertEqual(cpu.regs.bc, 0x4455)
 		cpu.decode()
 		self.assertEqual(cpu.regs.de, 0x2233)
 		cpu.decode()
-		self.assertEqual(cpu.regs.hl, 0x1122)
+		self.assertEqual(cpu.regs.hl, 0x1120)
 
 		cpu.decode()
 		cpu.decode()
@@ -697,6 +699,228 @@ class TestCpu(unittest.TestCase):
 		self._test_alu8([0xce, 0x20], 'a', 0x00, 0xb0, True, a=0xdf)  # set Z + C
 		self._test_alu8([0xce, 0x2a], 'a', 0x00, 0xb0, True, a=0xd5)  # set Z + C + H
 
+	# INC B 04 4
+	# DEC B 05 4
+	# SUB B 90 4
+	# SBC A,B 98 4
+	# CP B B8 4
+
+	def test_04(self):
+		self._test_alu8(0x04, 'b', 0x10, 0x30, True, b=0x0f)
+		self._test_alu8(0x04, 'b', 0x00, 0xa0, False, b=0xff)
+
+	def test_05(self):
+		self._test_alu8(0x05, 'b', 0x0f, 0x60, False, b=0x10)
+		self._test_alu8(0x05, 'b', 0x00, 0xd0, True, b=0x01)
+
+	def test_90(self):
+		self._test_alu8(0x90, 'a', 0x00, 0xc0, False, a=0x3e, b=0x3e)
+		self._test_alu8(0x90, 'a', 0x2f, 0x60, False, a=0x3e, b=0x0f)
+		self._test_alu8(0x90, 'a', 0xfe, 0x50, False, a=0x3e, b=0x40)
+
+	def test_98(self):
+		self._test_alu8(0x98, 'a', 0x10, 0x40, True, a=0x3b, b=0x2a)
+		self._test_alu8(0x98, 'a', 0xff, 0x70, True, a=0x00, b=0x00)
+
+	def test_b8(self):
+		self._test_alu8(0xb8, 'a', 0x3c, 0x60, False, a=0x3c, b=0x2f)
+		self._test_alu8(0xb8, 'a', 0x3c, 0xc0, False, a=0x3c, b=0x3c)
+
+	# AND B A0 4
+	# CPL 2F 4
+	# RL C CB 11 8
+	# SWAP A CB 37 8
+
+	def test_a0(self):
+		self._test_alu8(0xa0, 'a', 0x0c, 0x20, True, a=0x3c, b=0x0f)
+		self._test_alu8(0xa0, 'a', 0x00, 0xa0, False, a=0xf0, b=0x0f)
+
+	def test_2f(self):
+		self._test_alu8(0x2f, 'a', 0xca, 0x60, False, a=0x35)
+		self._test_alu8(0x2f, 'a', 0xca, 0x70, True, a=0x35)
+
+	def test_cb11(self):
+		self._test_alu8([0xcb, 0x11], 'c', 0x00, 0x90, False, c=0x80)
+		self._test_alu8([0xcb, 0x11], 'c', 0x23, 0x00, True, c=0x11)
+
+	def test_cb37(self):
+		self._test_alu8([0xcb, 0x37], 'a', 0x1f, 0x00, True, a=0xf1)
+		self._test_alu8([0xcb, 0x37], 'a', 0x00, 0x80, False, a=0x00)
+
+	def test_cb(self):
+		m = [0xcb, 0xc7, 0xcb, 0x87] + [0] * 65536
+		cpu = Cpu(m)
+		cpu.decode()
+		self.assertEqual(cpu.regs.a, 0x01)
+		self.assertEqual(cpu.regs.pc, 2)
+		self.assertEqual(cpu.time, 8)
+		cpu.decode()
+		self.assertEqual(cpu.regs.a, 0x00)
+		self.assertEqual(cpu.regs.pc, 4)
+
+	def test_unknown(self):
+		cpu = Cpu([0xd3] + [0] * 65536)
+		self.assertRaises(Exception, cpu.decode)
+
+	def test_run(self):
+		# nop x3, ei, nop...
+		m = [0x00, 0x00, 0x00, 0xfb] + [0] * 65536
+		cpu = Cpu(m)
+		self.assertEqual(cpu.run(8), 8)
+		self.assertEqual(cpu.regs.pc, 2)
+		# ei ends the batch early
+		self.assertEqual(cpu.run(100), 8)
+		self.assertEqual(cpu.regs.pc, 4)
+		self.assertTrue(cpu.ei)
+		cpu.run(4)
+		self.assertFalse(cpu.ei)
+		self.assertTrue(cpu.intr)
+
+	def test_sched(self):
+		cpu = Cpu([0] * 65536)
+		fired = []
+
+		def handler(t):
+			fired.append((t, cpu.time))
+			cpu.sched.at(t + 10, handler)
+
+		cpu.sched.at(10, handler)
+		ev = cpu.sched.at(25, lambda t: fired.append(None))
+		cpu.sched.cancel(ev)
+
+		# stops at the event even though the budget is larger
+		self.assertEqual(cpu.run(100), 12)
+		cpu.sched.run()
+		self.assertEqual(fired, [(10, 12)])
+		self.assertEqual(cpu.sched.next, 20)
+
+		cpu.run(100)
+		cpu.sched.run()
+		cpu.run(100)
+		cpu.sched.run()
+		self.assertEqual(fired, [(10, 12), (20, 20), (30, 32)])
+
+	def test_blocks(self):
+		# run the boot rom both ways and compare at every block boundary
+		ref = Cpu(MemCtrl())
+		cpu = Cpu(MemCtrl(), blocks=True)
+		cpu.blocks.hot = 0
+		for _ in range(9000):
+			cpu.run(1)
+			while ref.time < cpu.time:
+				ref.step()
+			self.assertEqual(ref.time, cpu.time)
+			self.assertEqual(str(ref.regs), str(cpu.regs))
+		self.assertEqual(ref.mc.ram, cpu.mc.ram)
+		self.assertEqual(cpu.regs.pc, 0x64)
+
+	def test_blocks_invalidate(self):
+		mc = MemCtrl()
+		cpu = Cpu(mc, blocks=True)
+		cpu.blocks.hot = 0
+		# ld a,1; jr -4
+		mc.ram[0xc000:0xc004] = bytes([0x3e, 0x01, 0x18, 0xfc])
+		cpu.regs.pc = 0xc000
+		cpu.run(1)
+		self.assertEqual(cpu.regs.a, 0x01)
+		self.assertEqual(cpu.regs.pc, 0xc000)
+
+		mc[0xc001] = 0x02
+		self.assertNotIn(0xc000, cpu.blocks.blocks)
+		cpu.run(1)
+		self.assertEqual(cpu.regs.a, 0x02)
+
+	def test_blocks_hot(self):
+		mc = MemCtrl()
+		cpu = Cpu(mc, blocks=True)
+		cpu.blocks.hot = 3
+		# ld a,1; jr -4
+		mc.ram[0xc000:0xc004] = bytes([0x3e, 0x01, 0x18, 0xfc])
+		cpu.regs.pc = 0xc000
+		# both instructions are interpreted three times before compiling
+		for n in range(6):
+			cpu.run(1)
+		self.assertEqual(cpu.insts, 6)
+		self.assertEqual(cpu.blocks.blocks, {})
+		self.assertEqual(cpu.blocks.hits[0xc000:0xc003], b'\x03\x00\x03')
+		cpu.run(1)
+		self.assertIn(0xc000, cpu.blocks.blocks)
+		self.assertEqual(cpu.insts, 8)
+		self.assertEqual(cpu.regs.pc, 0xc000)
+
+	def test_blocks_self_modify(self):
+		# ld hl,c007; ld a,3c; ld (hl),a; nop; jr -2, where the store turns
+		# the nop into inc a
+		prog = bytes([0x21, 0x07, 0xc0, 0x3e, 0x3c, 0x77, 0x00, 0x00, 0x18, 0xfe])
+		for blocks in (False, True):
+			mc = MemCtrl()
+			cpu = Cpu(mc, blocks=blocks)
+			if blocks:
+				cpu.blocks.hot = 0
+			mc.ram[0xc000:0xc00a] = prog
+			cpu.regs.pc = 0xc000
+			while cpu.time < 100:
+				cpu.run(100 - cpu.time)
+			self.assertEqual(cpu.regs.a, 0x3d)
+			self.assertEqual(cpu.regs.pc, 0xc008)
+			self.assertFalse(blocks and cpu.blocks.stale)
+
+	def test_ff(self):
+		mc = MemCtrl()
+		cpu = Cpu(mc)
+		mc.ram[0x0200] = 0xff
+		cpu.regs.pc = 0x0200
+		cpu.regs.sp = 0xfffe
+		cpu.decode()
+		self.assertEqual(cpu.regs.pc, 0x0038)
+		self.assertEqual(cpu.regs.sp, 0xfffc)
+		self.assertEqual(mc.read16(0xfffc), 0x0201)
+
+	def test_lazy(self):
+		# add a,b; inc a; adc a,a
+		cpu = Cpu([0x80, 0x3c, 0x8f], lazy=True)
+		cpu.regs.a = 0xff
+		cpu.regs.b = 0x01
+		cpu.decode()
+		self.assertIsNotNone(cpu.regs.f.pend)
+		self.assertEqual(cpu.regs.af, 0x00b0)
+		cpu.decode()
+		# inc keeps the carry of the add
+		self.assertEqual(cpu.regs.af, 0x0110)
+		cpu.decode()
+		self.assertEqual(cpu.regs.af, 0x0300)
+
+	def test_snapshot(self):
+		cpu = Cpu([0x80], lazy=True)
+		cpu.regs.af = 0xff00
+		cpu.regs.bc = 0x0102
+		cpu.regs.hl = 0x0304
+		cpu.regs.sp = 0xfffe
+		cpu.decode()
+		buf = cpu.regs.snapshot()
+		self.assertEqual(len(buf), 12)
+
+		ref = str(cpu.regs)
+		cpu.regs.af = 0
+		cpu.regs.pc = 0x100
+		cpu.regs.restore(buf)
+		self.assertEqual(str(cpu.regs), ref)
+		self.assertEqual(cpu.regs.af, 0x00b0)
+
+	def test_lazy_boot(self):
+		for blocks in (False, True):
+			ref = Cpu(MemCtrl())
+			cpu = Cpu(MemCtrl(), blocks=blocks, lazy=True)
+			while cpu.time < 266488:
+				cpu.run(1)
+				while ref.time < cpu.time:
+					ref.step()
+				self.assertEqual(ref.time, cpu.time)
+				self.assertEqual(ref.regs.af, cpu.regs.af)
+				self.assertEqual(str(ref.regs), str(cpu.regs))
+			self.assertEqual(cpu.regs.pc, 0x64)
+			self.assertEqual(cpu.insts, ref.insts)
+
 
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+
+from cpu import Cpu
+from debug import DebugShell
+from mmu import MemCtrl
+
+
+class Shell(DebugShell):
+	def __init__(self):
+		super().__init__()
+		self.stops = []
+
+	def show_prompt(self):
+		self.stops.append((self.cpu.regs.pc, self.addr))
+		self.update()
+
+
+class TestDebug(unittest.TestCase):
+	def _cpu(self):
+		dbg = Shell()
+		mc = MemCtrl(debugger=dbg)
+		cpu = Cpu(mc, debugger=dbg, blocks=True)
+		cpu.setup()
+		return cpu, mc, dbg
+
+	def test_idle(self):
+		cpu, mc, dbg = self._cpu()
+		self.assertIsNone(cpu.dbg)
+		self.assertIsNone(cpu.mc.dbg)
+		self.assertIsNone(mc.dbg)
+		cpu.run(10000)
+		self.assertEqual(dbg.stops, [])
+
+	def test_break(self):
+		cpu, mc, dbg = self._cpu()
+		dbg.add_break(0x0003)
+		self.assertIs(cpu.dbg, dbg)
+		self.assertIsNone(mc.dbg)
+		cpu.run(100)
+		self.assertEqual(dbg.stops, [(0x0003, 0x0003)])
+
+		dbg.remove_break(0x0003)
+		self.assertIsNone(cpu.dbg)
+
+	def test_watch(self):
+		cpu, mc, dbg = self._cpu()
+		dbg.add_watch(0x9ffe)
+		self.assertIsNone(cpu.dbg)
+		self.assertIs(mc.dbg, dbg)
+		cpu.run(100)
+		self.assertEqual(dbg.stops, [(0x0007, 0x9ffe)])
+
+		dbg.remove_watch(0x9ffe)
+		self.assertIsNone(mc.dbg)
+		self.assertFalse(cpu.watched)
+
+	def test_watch_step(self):
+		cpu, mc, dbg = self._cpu()
+		prompt = dbg.show_prompt
+
+		def show_prompt():
+			prompt()
+			if len(dbg.stops) < 3:
+				dbg.onecmd('n')
+				dbg.update()
+
+		dbg.show_prompt = show_prompt
+		dbg.add_watch(0x9ffe)
+		while cpu.time < 100000:
+			cpu.run(100000 - cpu.time)
+		# 0007 ld (hl-), a, then cb 7c and jr nz at 0008 and 000a
+		self.assertEqual(dbg.stops, [(0x0007, 0x9ffe), (0x0008, 0x0008), (0x000a, 0x000a)])
+
+	def test_watch_range(self):
+		cpu, mc, dbg = self._cpu()
+		seen = []
+		on_write = dbg.on_write
+		dbg.on_write = lambda addr, v: (seen.append(addr), on_write(addr, v))
+
+		dbg.onecmd('w 0x9f80-0x9fff w')
+		self.assertEqual(dbg.watches, {(0x9f80, 0x9fff): ('w', None)})
+		self.assertEqual(dbg.wpages[0x9f], 1)
+		self.assertEqual(dbg.wpages[0x9e], 0)
+		self.assertEqual(dbg.rpages, bytes(0x100))
+
+		mc[0xc000] = 1
+		mc[0x9e00] = 1
+		self.assertEqual(seen, [])
+		mc[0x9f7f] = 1
+		mc[0x9f80] = 1
+		self.assertEqual(dbg.stops, [(0, 0x9f80)])
+		self.assertEqual(seen, [0x9f7f, 0x9f80])
+
+		dbg.onecmd('rw 0x9f80-0x9fff')
+		self.assertEqual(dbg.wmap, bytes(0x10000))
+		self.assertEqual(dbg.wpages, bytes(0x100))
+		self.assertIsNone(mc.dbg)
+
+	def test_cond_break(self):
+		cpu, mc, dbg = self._cpu()
+		# the clear loop at 0007 runs until h drops to 0x7f
+		dbg.onecmd('b 0x0007 if r.h == 0x80 and m[a] == 0x32')
+		dbg.onecmd('b 0x0008-0x0009 if d.step')
+		self.assertEqual(dbg.xmap[0x0007:0x000a], b'\x02\x02\x02')
+		cpu.run(300000)
+		self.assertEqual(dbg.stops, [(0x0007, 0x0007)] * 0x100)
+		self.assertEqual(len(dbg.exprs), 2)
+
+	def test_cond_watch(self):
+		cpu, mc, dbg = self._cpu()
+		dbg.onecmd('w 0x8000-0x9fff w if (a & 0xff) == 0x10')
+		dbg.add_watch(0x8010, 'r')
+		self.assertEqual(dbg.wmap[0x8010], 2)
+		self.assertEqual(dbg.rmap[0x8010], 1)
+		cpu.run(300000)
+		self.assertEqual(dbg.stops[:33],
+		                 [(0x0007, a) for a in range(0x9f10, 0x8000, -0x100)] +
+		                 [(0x00a3, 0x8010)])
+
+	def test_cov(self):
+		cpu, mc, dbg = self._cpu()
+		dbg.onecmd('ecov')
+		cpu.run(100)
+		dbg.onecmd('dcov')
+		self.assertIsNone(cpu.cover)
+		n = dbg.cov.x.count(1)
+
+		# Re-enabling keeps adding to the same bitmaps
+		cov = dbg.cov
+		dbg.onecmd('ecov')
+		self.assertIs(cpu.cover, cov)
+		cpu.regs.pc = 0x00e0
+		cpu.step()
+		self.assertEqual(cov.x.count(1), n + 3)
+
+	def test_eval(self):
+		cpu, mc, dbg = self._cpu()
+		cpu.regs.a = 0x3c
+		self.assertEqual(dbg.eval('r.a + 1'), 0x3d)
+		self.assertIn('r.a + 1', dbg.exprs)
+		self.assertEqual(dbg.eval('a', 0x1234), 0x1234)
+
+	def test_trace(self):
+		cpu, mc, dbg = self._cpu()
+		dbg.onecmd('ect')
+		self.assertIs(cpu.dbg, dbg)
+		self.assertIs(cpu.mc.dbg, dbg)
+		cpu.run(100)
+		recs = dbg.trace.last(3)
+		self.assertEqual([r[0] for r in recs], [0x000a, 0x0007, 0x0008])
+
+		dbg.onecmd('dct')
+		self.assertIsNone(cpu.dbg)
+
+
+if __name__ == '__main__':
+	unittest.main()
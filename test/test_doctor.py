@@ -0,0 +1,52 @@
+import unittest
+
+import doctor
+
+
+class TestDoctor(unittest.TestCase):
+	def _log(self, n):
+		cpu = doctor.setup(None, boot=True)
+		lines = []
+		for _ in range(n):
+			lines.append(doctor.state(cpu) + '\n')
+			cpu.step()
+		return lines
+
+	def test_state(self):
+		cpu = doctor.setup(bytes(range(256)) * 2)
+		self.assertEqual(
+		    doctor.state(cpu), 'A:01 F:B0 B:00 C:13 D:00 E:D8 H:01 L:4D '
+		    'SP:FFFE PC:0100 PCMEM:00,01,02,03')
+		self.assertEqual(cpu.mc[0xff44], 0x90)
+
+	def test_match(self):
+		lines = self._log(500)
+		self.assertIsNone(doctor.compare(doctor.setup(None, boot=True), iter(lines)))
+
+	def test_diverge(self):
+		lines = self._log(500)
+		lines[300] = lines[300].replace('F:', 'F:1')[:-1]
+		n, expect, got, hist = doctor.compare(doctor.setup(None, boot=True),
+		                                      iter(lines), keep=4)
+		self.assertEqual(n, 300)
+		self.assertEqual(hist, [l.strip() for l in lines[296:300]])
+		self.assertEqual(doctor.diff(expect, got), ['F'])
+
+	def test_raise(self):
+		cpu = doctor.setup(bytes(0x100) + b'\x00\x27')
+		lines = [doctor.state(cpu)]
+		cpu.step()
+		lines.append(doctor.state(cpu))
+		n, expect, got, hist = doctor.compare(doctor.setup(bytes(0x100) + b'\x00\x27'), lines)
+		self.assertEqual(n, 1)
+		self.assertEqual(expect, lines[1])
+		self.assertIsInstance(got, Exception)
+		self.assertEqual(hist, lines[:1])
+
+	def test_lazy(self):
+		lines = self._log(500)
+		self.assertIsNone(doctor.compare(doctor.setup(None, True, lazy=True), iter(lines)))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,190 @@
+import contextlib
+import io
+import unittest
+
+import display
+import gpu
+from cpu import Cpu
+from mmu import MemCtrl
+
+FRAME = 70224
+
+
+class TestGpu(unittest.TestCase):
+	def setUp(self):
+		self.frames = []
+		self.mc = MemCtrl()
+		self.cpu = Cpu(self.mc)
+		self.lcd = display.Headless(on_frame=self.frames.append)
+
+	def make(self, **kw):
+		g = gpu.Gpu(self.mc, self.cpu.sched, display=self.lcd, **kw)
+		# Tile 1 is a column of color 1 next to one of color 3, at the
+		# first map entry
+		for addr in range(0x8010, 0x8020, 2):
+			self.mc[addr] = 0xf0
+			self.mc[addr + 1] = 0x0f
+		self.mc[0x9800] = 1
+		return g
+
+	def run_frames(self, n, lcdc=0x91):
+		with contextlib.redirect_stdout(io.StringIO()):
+			self.mc[0xff40] = lcdc
+		sched = self.cpu.sched
+		while self.cpu.time < FRAME * n:
+			self.cpu.time = sched.next
+			sched.run()
+
+	def test_frames(self):
+		g = self.make()
+		g.setup()
+		self.run_frames(3)
+		self.assertEqual(len(self.frames), 3)
+		self.assertIs(self.frames[0], self.lcd)
+		self.assertEqual(self.lcd.frames, 3)
+
+	def test_scene_names(self):
+		# Lcd puts Pythonista's Scene first, whose Node has a frame rect
+		class Node(object):
+			frame = (0, 0, 166, 140)
+			palette = None
+
+		class Lcd(Node, display.Display):
+			pass
+
+		self.lcd = Lcd(on_frame=self.frames.append)
+		self.make()
+		self.run_frames(2)
+		self.mc[0xff47] = 0x1b
+		self.assertEqual(len(self.frames), 2)
+		self.assertEqual(self.lcd.bgp, 0x1b)
+
+	def test_render(self):
+		self.make()
+		self.run_frames(1)
+		vram = self.lcd.vram
+		self.assertEqual(len(vram), self.lcd.width * self.lcd.height)
+		w = self.lcd.width
+		for y in (0, 7, 8):
+			row = vram[y * w:y * w + 10]
+			if y < 8:
+				self.assertEqual(row, b'\x01' * 4 + b'\x02' * 4 + b'\x00' * 2)
+			else:
+				self.assertEqual(row, bytes(10))
+
+	def test_scroll(self):
+		self.make()
+		self.mc[0xff43] = 2
+		self.mc[0xff42] = 4
+		self.run_frames(1)
+		w = self.lcd.width
+		self.assertEqual(self.lcd.vram[0:8], b'\x01' * 2 + b'\x02' * 4 + b'\x00' * 2)
+		self.assertEqual(self.lcd.vram[4 * w:4 * w + 2], bytes(2))
+
+	def test_wrap(self):
+		self.make()
+		self.mc[0xff43] = 0xfe
+		self.run_frames(1)
+		self.assertEqual(self.lcd.vram[0:12], bytes(2) + b'\x01' * 4 + b'\x02' * 4 + bytes(2))
+
+	def test_incremental(self):
+		g = self.make()
+		self.run_frames(1)
+		self.assertFalse(g.pending)
+		w = self.lcd.width
+
+		# Tile data: every cell using tile 1 is redrawn
+		self.mc[0x9820] = 1
+		self.mc[0x8010] = 0xff
+		self.assertTrue(g.pending)
+		self.run_frames(2)
+		self.assertEqual(self.lcd.vram[0:8], b'\x01' * 4 + b'\x03' * 4)
+		self.assertEqual(self.lcd.vram[8 * w:8 * w + 8], b'\x01' * 4 + b'\x03' * 4)
+		self.assertEqual(self.lcd.vram[9 * w:9 * w + 8], b'\x01' * 4 + b'\x02' * 4)
+
+		# The last map entry
+		self.mc[0x9bff] = 1
+		self.mc[0xff42] = 0xf8
+		self.mc[0xff43] = 0xf8
+		self.run_frames(3)
+		self.assertEqual(self.lcd.vram[1:8], b'\x01' * 3 + b'\x03' * 4)
+
+		# Rewriting the same value changes nothing
+		self.mc[0x9bff] = 1
+		self.assertFalse(g.pending)
+
+	def test_invalidate(self):
+		g = self.make()
+		self.mc[0x9c00] = 1
+		self.mc[0x9fff] = 1
+		self.run_frames(1)
+		self.assertEqual(g.buf[255 * 256 + 248:], bytes(8))
+
+		# Switching to the 9c00 map redraws it whole
+		self.run_frames(2, 0x99)
+		self.assertEqual(g.buf[255 * 256 + 248:], b'\x01' * 4 + b'\x02' * 4)
+		self.assertEqual(g.buf[0:8], b'\x01' * 4 + b'\x02' * 4)
+
+	def test_window(self):
+		g = self.make()
+		self.mc[0x9c00] = 1
+		self.mc[0xff4a] = 8
+		self.mc[0xff4b] = 7 + 16
+		self.mc[0xff43] = 4
+		self.run_frames(1, 0xf1)
+		vram = self.lcd.vram
+		w = self.lcd.width
+		# Scrolled BG above the window, window below WY from WX - 7 on
+		self.assertEqual(vram[0:8], b'\x02' * 4 + bytes(4))
+		self.assertEqual(vram[7 * w + 16:7 * w + 24], bytes(8))
+		self.assertEqual(vram[8 * w:8 * w + 16], bytes(16))
+		self.assertEqual(vram[8 * w + 16:8 * w + 26], b'\x01' * 4 + b'\x02' * 4 + bytes(2))
+		self.assertEqual(vram[16 * w + 16:16 * w + 24], bytes(8))
+
+		# WX below 7 clips the window's left edge
+		self.mc[0xff4b] = 3
+		self.run_frames(2, 0xf1)
+		self.assertEqual(vram[8 * w:8 * w + 6], b'\x02' * 4 + bytes(2))
+		self.assertEqual(g.winline, 140 - 8)
+
+	def test_palette(self):
+		g = self.make()
+		self.assertEqual(self.lcd.lut, [0.9, 0.7, 0.5, 0.3])
+		self.run_frames(1)
+		self.mc[0xff47] = 0x1b
+		self.assertEqual(g.bgp, 0x1b)
+		self.assertEqual(self.mc[0xff47], 0x1b)
+		self.assertEqual(self.lcd.lut, [0.3, 0.5, 0.7, 0.9])
+
+		# Indices are untouched; the palette applies on the way out
+		self.assertEqual(self.lcd.vram[0:5], b'\x01' * 4 + b'\x02')
+		rgba = self.lcd.rgba()
+		self.assertEqual(len(rgba), 4 * len(self.lcd.vram))
+		self.assertEqual(rgba[0:4], bytes(display.RGBA[2]))
+		self.assertEqual(rgba[16:20], bytes(display.RGBA[1]))
+		self.assertEqual(rgba[32:36], bytes(display.RGBA[3]))
+
+	@unittest.skipUnless(gpu.np, 'numpy not installed')
+	def test_vectorize(self):
+		# Both addressing modes and odd scroll values, with tile data and
+		# maps rewritten between frames
+		def frames(vectorize):
+			self.setUp()
+			g = self.make(vectorize=vectorize)
+			self.assertEqual(g.vectorize, vectorize)
+			out = []
+			seed = 1
+			for lcdc, scx, scy in ((0x91, 0xfd, 0x03), (0x81, 0x07, 0xf9),
+			                       (0x89, 0x81, 0x45), (0xf9, 0x33, 0xbb)):
+				for addr in range(0x8000, 0xa000, 7):
+					seed = seed * 1103515245 + 12345 & 0x7fffffff
+					self.mc[addr] = seed >> 16 & 0xff
+				self.mc[0xff43] = scx
+				self.mc[0xff42] = scy
+				self.run_frames(len(out) + 1, lcdc)
+				out.append((bytes(self.lcd.vram), bytes(g.buf), bytes(g.win)))
+			return out
+
+		ref = frames(False)
+		self.assertEqual(len(set(f[0] for f in ref)), 4)
+		self.assertEqual(frames(True), ref)
@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+import unittest
+
+import metrics
+from cpu import Cpu
+from mmu import MemCtrl
+
+
+class TestMetrics(unittest.TestCase):
+	def test_report(self):
+		cpu = Cpu(MemCtrl(), blocks=True)
+		lines = []
+		with tempfile.TemporaryDirectory() as d:
+			path = os.path.join(d, 'm.jsonl')
+			m = metrics.Metrics(cpu, every=2, path=path, out=lines.append)
+			m.start()
+			sched = cpu.sched
+			while cpu.time < metrics.FRAME * 6:
+				cpu.run(sched.next - cpu.time)
+				sched.run()
+			m.stop()
+
+			with open(path) as f:
+				samples = [json.loads(l) for l in f]
+
+		self.assertEqual(len(lines), 3)
+		self.assertEqual([s['time'] for s in samples],
+		                 [metrics.FRAME * n for n in (2, 4, 6)])
+		for s in samples:
+			self.assertGreater(s['fps'], 0)
+			self.assertGreater(s['ips'], 0)
+			for k in ('samples', 'share', 'stderr', 'est_ns'):
+				self.assertEqual(set(s[k]), set(metrics.SUBSYSTEMS))
+			n = sum(s['samples'].values())
+			if n:
+				self.assertAlmostEqual(sum(s['share'].values()), 1)
+				self.assertEqual(s['share']['cpu'], s['samples']['cpu'] / n)
+		self.assertIn('fps', lines[0])
+
+	def test_classify(self):
+		m = metrics.Metrics(Cpu(MemCtrl()))
+
+		class Code:
+			def __init__(self, name):
+				self.co_filename = name
+
+		class Frame:
+			def __init__(self, name, back=None):
+				self.f_code = Code(name)
+				self.f_back = back
+
+		self.assertEqual(m.classify(Frame('/x/mmu.py', Frame('/x/inst.py'))), 'mmu')
+		self.assertEqual(m.classify(Frame('/usr/lib/cmd.py', Frame('/x/debug.py'))),
+		                 'debugger')
+		self.assertEqual(m.classify(Frame('/x/gpu.py')), 'ppu')
+		self.assertEqual(m.classify(None), 'other')
+
+
+if __name__ == '__main__':
+	unittest.main()
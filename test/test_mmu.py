@@ -0,0 +1,76 @@
+import unittest
+
+from mmu import MemCtrl
+
+
+class TestMmu(unittest.TestCase):
+	def test_ram(self):
+		mc = MemCtrl()
+		mc[0xc000] = 0x1ff
+		self.assertEqual(mc[0xc000], 0xff)
+		self.assertEqual(mc.ram[0xc000], 0xff)
+		self.assertEqual(mc.rdpages, [None] * 0x100)
+		self.assertEqual(mc.wrpages, [None] * 0x100)
+
+	def test_hooks(self):
+		mc = MemCtrl()
+		reads = []
+		writes = []
+
+		def rd(addr):
+			reads.append(addr)
+			return 0x42
+
+		def wr(addr, val):
+			writes.append((addr, val))
+			return addr == 0xff40
+
+		mc.add_rdhook(0xff44, rd)
+		mc.add_wrhook((0x80f0, 0x8110), wr)
+		mc.add_wrhook(0xff40, wr)
+		self.assertIsNone(mc.rdpages[0xfe])
+		self.assertIsNone(mc.wrpages[0x82])
+
+		self.assertEqual(mc[0xff44], 0x42)
+		self.assertEqual(mc[0xff45], 0x00)
+		self.assertEqual(reads, [0xff44])
+
+		mc[0x80ef] = 1
+		mc[0x80f0] = 2
+		mc[0x810f] = 3
+		mc[0x8110] = 4
+		self.assertEqual(writes, [(0x80f0, 2), (0x810f, 3)])
+		self.assertEqual(mc.ram[0x80f0:0x80f1], b'\x02')
+		self.assertEqual(mc.ram[0x8110], 4)
+
+		# a hook returning true swallows the write
+		mc[0xff40] = 0x91
+		self.assertEqual(mc.ram[0xff40], 0)
+
+	def test_words(self):
+		mc = MemCtrl()
+		mc.write16(0xc000, 0x1234)
+		self.assertEqual(mc.ram[0xc000:0xc002], b'\x34\x12')
+		self.assertEqual(mc.read16(0xc000), 0x1234)
+		mc.write16(0xffff, 0xabcd)
+		self.assertEqual(mc.ram[0xffff], 0xcd)
+		self.assertEqual(mc.ram[0x0000], 0xab)
+		self.assertEqual(mc.read16(0xffff), 0xabcd)
+
+		# words that touch a hooked page go byte by byte
+		writes = []
+		mc.add_wrhook(0x8000, lambda addr, val: writes.append((addr, val)))
+		mc.add_rdhook(0x8000, lambda addr: 0x55)
+		mc.write16(0x7fff, 0x9988)
+		self.assertEqual(writes, [(0x8000, 0x99)])
+		self.assertEqual(mc.read16(0x7fff), 0x5588)
+
+		invalid = []
+		mc.on_code_write = invalid.append
+		mc.code[0xd001] = 1
+		mc.write16(0xd000, 0)
+		self.assertEqual(invalid, [0xd001])
+
+
+if __name__ == '__main__':
+	unittest.main()
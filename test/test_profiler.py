@@ -0,0 +1,82 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+import profiler
+import sym
+from cpu import Cpu
+from mmu import MemCtrl
+
+
+class TestProfiler(unittest.TestCase):
+	def _run(self, n):
+		cpu = Cpu(MemCtrl())
+		prof = profiler.OpProfile()
+		for _ in range(n):
+			prof.before(cpu)
+			cpu.step()
+			prof.after(cpu)
+		return cpu, prof
+
+	def test_counts(self):
+		cpu, prof = self._run(1000)
+		self.assertEqual(sum(prof.counts), 1000)
+		self.assertEqual(sum(prof.hits), 1000)
+		self.assertEqual(sum(prof.cycles), cpu.time)
+		# ld (hl-),a; bit 7,h; jr nz
+		self.assertEqual(prof.counts[0x32], 333)
+		self.assertEqual(prof.counts[0x17c], 332)
+		self.assertEqual(prof.hits[0x0007], 333)
+		self.assertEqual(prof.cycles[0x20], 332 * 12)
+		self.assertEqual(prof.pcs()[0], (0x0007, 333))
+		self.assertIn('bit 7,h', prof.report(5))
+
+	def test_export(self):
+		cpu, prof = self._run(100)
+		with tempfile.TemporaryDirectory() as d:
+			prof.export(os.path.join(d, 'p.json'))
+			with open(os.path.join(d, 'p.json')) as f:
+				data = json.load(f)
+			self.assertEqual(sum(o['count'] for o in data['ops']), 100)
+			self.assertEqual(data['pcs'][0], {'pc': 0x0007, 'hits': 33})
+
+			prof.export(os.path.join(d, 'p.csv'))
+			with open(os.path.join(d, 'p.csv')) as f:
+				rows = list(csv.DictReader(f))
+			self.assertEqual(sum(int(r['count']) for r in rows if r['kind'] == 'op'), 100)
+
+	def test_stacks(self):
+		mc = MemCtrl()
+		# main: call func; jr main
+		mc.ram[0xc000:0xc005] = bytes([0xcd, 0x00, 0xc1, 0x18, 0xfb])
+		# func: call inner; ret
+		mc.ram[0xc100:0xc104] = bytes([0xcd, 0x00, 0xc2, 0xc9])
+		# inner: ld b,16; dec b; jr nz,-3; ret
+		mc.ram[0xc200:0xc206] = bytes([0x06, 0x10, 0x05, 0x20, 0xfd, 0xc9])
+		syms = sym.Symbols()
+		syms.addrs = [0xc000, 0xc100, 0xc200]
+		syms.names = ['main', 'func', 'inner']
+
+		for blocks in (False, True):
+			cpu = Cpu(mc, blocks=blocks)
+			cpu.regs.pc = 0xc000
+			cpu.regs.sp = 0xfffe
+			s = profiler.StackSampler(cpu, 10, syms)
+			s.start()
+			sched = cpu.sched
+			while cpu.time < 100000:
+				cpu.run(sched.next - cpu.time)
+				sched.run()
+			s.stop()
+
+			self.assertNotIn('call', cpu.__dict__)
+			self.assertEqual(sum(s.samples.values()), cpu.time // 10)
+			stacks = dict(l.rsplit(' ', 1) for l in s.collapsed())
+			self.assertEqual(set(stacks), {'main', 'main;func', 'main;func;inner'})
+			self.assertGreater(int(stacks['main;func;inner']), 7000)
+
+
+if __name__ == '__main__':
+	unittest.main()
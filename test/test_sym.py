@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+import sym
+
+
+class TestSym(unittest.TestCase):
+	def test_lookup(self):
+		with tempfile.TemporaryDirectory() as d:
+			path = os.path.join(d, 'game.sym')
+			with open(path, 'w') as f:
+				f.write('; File generated by rgblink\n'
+				        '00:0150 Main\n'
+				        '00:0100 Start ; entry\n'
+				        '01:4000 Bank1Code\n'
+				        '02:4000 Bank2Code\n'
+				        '00:c000 wBuffer\n'
+				        '\n')
+			s = sym.Symbols(path)
+
+		self.assertEqual(s.addrs, [0x0100, 0x0150, 0x4000, 0xc000])
+		self.assertEqual(s.lookup(0x00ff), (None, 0x00ff))
+		self.assertEqual(s.lookup(0x0100), ('Start', 0))
+		self.assertEqual(s.lookup(0x0172), ('Main', 0x22))
+		self.assertEqual(s.lookup(0x7fff), ('Bank1Code', 0x3fff))
+		self.assertEqual(s.name(0xc010), 'wBuffer+10')
+		self.assertEqual(s.name(0x0150), 'Main')
+		self.assertEqual(s.name(0x0050), '0050')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+import tracer
+from cpu import Cpu
+from mmu import MemCtrl
+
+
+class TestTracer(unittest.TestCase):
+	def test_ring(self):
+		cpu = Cpu(MemCtrl())
+		t = tracer.TraceBuffer(size=8, chunk=4)
+		pcs = []
+		for _ in range(20):
+			pcs.append(cpu.regs.pc)
+			t.record(cpu)
+			cpu.step()
+		self.assertEqual(t.pos, 20)
+		self.assertEqual([r[0] for r in t.last(100)], pcs[-8:])
+		self.assertEqual([r[0] for r in t.last(3)], pcs[-3:])
+
+		self.assertEqual(tracer.REC.unpack_from(t.buf, 0)[:4], (0x0008, 0xcb, 0x7c, 0x20))
+		self.assertEqual(
+		    tracer.fmt(t.last(1)[0]),
+		    '0008: cb 7c    bit 7,h          A:00 F:20 B:00 C:00 D:00 E:00 '
+		    'H:9f L:f9 SP:fffe T:176')
+
+	def test_stream(self):
+		cpu = Cpu(MemCtrl())
+		with tempfile.TemporaryDirectory() as d:
+			path = os.path.join(d, 'trace.bin')
+			t = tracer.TraceBuffer(size=16, path=path, chunk=8)
+			recs = []
+			for _ in range(61):
+				t.record(cpu)
+				recs.append(t.last(1)[0])
+				cpu.step()
+			t.close()
+			self.assertEqual(list(tracer.read(path, chunk=5)), recs)
+
+
+if __name__ == '__main__':
+	unittest.main()
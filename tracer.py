@@ -0,0 +1,100 @@
+import queue
+import struct
+import sys
+import threading
+
+import inst
+
+# pc, opcode bytes, a f b c d e h l, sp, cycles
+REC = struct.Struct('<H3B8BHQ')
+
+
+class Writer(threading.Thread):
+	def __init__(self, path):
+		super().__init__(daemon=True)
+		self.f = open(path, 'wb')
+		self.q = queue.Queue()
+
+	def run(self):
+		while True:
+			b = self.q.get()
+			if b is None:
+				break
+			self.f.write(b)
+		self.f.close()
+
+	def close(self):
+		self.q.put(None)
+		self.join()
+
+
+class TraceBuffer(object):
+	# Fixed-size records in a preallocated ring. With a path, every chunk of
+	# records is also handed to a background thread that appends it to a file.
+	def __init__(self, size=1 << 16, path=None, chunk=1 << 12):
+		if size % chunk:
+			raise ValueError(f'chunk {chunk} does not divide size {size}')
+		self.size = size
+		self.chunk = chunk
+		self.buf = bytearray(REC.size * size)
+		self.pos = 0
+		self.writer = None
+		if path:
+			self.writer = Writer(path)
+			self.writer.start()
+
+	def record(self, cpu):
+		r = cpu.regs
+		ram = cpu.mc.ram
+		pc = r.pc
+		i = self.pos
+		REC.pack_into(self.buf, (i % self.size) * REC.size, pc, ram[pc],
+		              ram[(pc + 1) & 0xffff], ram[(pc + 2) & 0xffff], r.a, r.f.val,
+		              r.b, r.c, r.d, r.e, r.h, r.l, r.sp, cpu.time)
+		i += 1
+		self.pos = i
+		if self.writer and i % self.chunk == 0:
+			self.flush(i - self.chunk)
+
+	def flush(self, start):
+		# Queue records from start up to pos; they never straddle the ring end
+		s = (start % self.size) * REC.size
+		self.writer.q.put(bytes(self.buf[s:s + (self.pos - start) * REC.size]))
+
+	def close(self):
+		if self.writer:
+			self.flush(self.pos - self.pos % self.chunk)
+			self.writer.close()
+			self.writer = None
+
+	def last(self, n):
+		n = min(n, self.pos, self.size)
+		return [
+		    REC.unpack_from(self.buf, (i % self.size) * REC.size)
+		    for i in range(self.pos - n, self.pos)
+		]
+
+
+def read(path, chunk=1 << 12):
+	with open(path, 'rb') as f:
+		while True:
+			b = f.read(REC.size * chunk)
+			if not b:
+				break
+			yield from REC.iter_unpack(b)
+
+
+def fmt(rec):
+	pc, op, op1, op2, a, f, b, c, d, e, h, l, sp, time = rec
+	code = 0xcb00 | op1 if op == 0xcb else op
+	size = getattr(inst.insts.get(code), 'size', 1)
+	ops = ' '.join(f'{x:02x}' for x in (op, op1, op2)[:size])
+	mnem = inst.mnemonics.get(code, 'unknown op')
+	return (f'{pc:04x}: {ops:<8} {mnem:<16} A:{a:02x} F:{f:02x} B:{b:02x} '
+	        f'C:{c:02x} D:{d:02x} E:{e:02x} H:{h:02x} L:{l:02x} SP:{sp:04x} '
+	        f'T:{time}')
+
+
+if __name__ == '__main__':
+	for rec in read(sys.argv[1]):
+		print(fmt(rec))